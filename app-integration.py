@@ -5,6 +5,33 @@ This file contains the key updates needed for better document RAG integration in
 These changes should be applied to the appropriate files (app.py, enhanced_routes.py).
 """
 
+import os
+import copy
+import hashlib
+import inspect
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from loguru import logger
+
+from enhanced_integration.document_manager import get_document_manager
+from web_interface.direct_integration import direct_analyze_text
+
+# Optional direct_analyze_text parameters, checked once at import
+_DIRECT_ANALYZE_PARAMS = inspect.signature(direct_analyze_text).parameters
+_SUPPORTS_DOCUMENT_CONTEXT = 'document_context' in _DIRECT_ANALYZE_PARAMS
+_SUPPORTS_INCLUDE_REASONING = 'include_reasoning' in _DIRECT_ANALYZE_PARAMS
+
+# LRU cache of analysis results keyed by (text, mode, use_sot, include_reasoning, document hashes, model)
+ANALYSIS_CACHE_SIZE = 512
+_analysis_cache = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# Shared pool for generating questions and reasoning side by side
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
 #
 # Updates for app.py
 #
@@ -15,7 +42,6 @@ def app_py_init_document_manager():
     Should be placed after app initialization but before route registration.
     """
     # Initialize document manager and make it available to the app
-    from enhanced_integration.document_manager import get_document_manager
     document_manager = get_document_manager()
     app.config['DOCUMENT_MANAGER'] = document_manager
     
@@ -45,49 +71,8 @@ def app_py_init_document_manager():
 # Updates for enhanced_routes.py chat endpoint
 #
 
-def enhanced_chat_with_rag(message, mode, use_sot, use_rag, document_context=None):
-    """
-    An improved version of the chat message handler that better integrates document RAG.
-    This should replace or be integrated into the existing chat_message function in enhanced_routes.py.
-    """
-    # Get document content for RAG
-    if use_rag:
-        # Get document manager
-        document_manager = get_document_manager()
-        
-        if document_context:
-            # Ensure documents in context have content
-            for i, doc in enumerate(document_context):
-                if "document_id" in doc and "content" not in doc:
-                    content = document_manager.get_document_content(doc["document_id"])
-                    if content:
-                        document_context[i]["content"] = content
-                        document_context[i]["relevance"] = 0.95  # High relevance for manually selected docs
-        else:
-            # If no specific documents provided, automatically retrieve relevant ones
-            document_context = document_manager.get_documents_for_rag(message, limit=3)
-            if document_context:
-                logger.info(f"Retrieved {len(document_context)} relevant documents for RAG")
-    else:
-        document_context = []
-    
-    # Process with direct integration, handling document context
-    from web_interface.direct_integration import direct_analyze_text
-    try:
-        # Try with document_context parameter
-        result = direct_analyze_text(message, mode, use_sot, document_context=document_context)
-    except TypeError as e:
-        if "document_context" in str(e):
-            # Fallback to call without document_context
-            logger.warning("direct_analyze_text() doesn't support document_context, falling back")
-            result = direct_analyze_text(message, mode, use_sot)
-            
-            # Add document context to the result manually
-            result["document_context"] = document_context
-        else:
-            # Re-raise any other errors
-            raise
-    
+def _build_chat_response(message, result, document_context):
+    """Build the chat reply and response data from an analysis result."""
     # Generate a response based on the analysis
     if result['issues'] and result['questions']:
         # Craft a response that includes one of the Socratic questions
@@ -105,7 +90,7 @@ def enhanced_chat_with_rag(message, mode, use_sot, use_rag, document_context=Non
         reply = "I've considered your statement. It seems clear and well-formed. Do you have any other thoughts you'd like to explore?"
     
     # Prepare the response data with document context
-    response = {
+    return {
         'reply': reply,
         'text': message,
         'issues': result['issues'],
@@ -118,14 +103,91 @@ def enhanced_chat_with_rag(message, mode, use_sot, use_rag, document_context=Non
         'provider': result['provider'],
         'document_context': document_context
     }
+
+def enhanced_chat_with_rag(message, mode, use_sot, use_rag, document_context=None, include_reasoning=None):
+    """
+    An improved version of the chat message handler that better integrates document RAG.
+    This should replace or be integrated into the existing chat_message function in enhanced_routes.py.
     
-    return response
+    SoT reasoning is shown with the chat reply, so by default it is generated
+    whenever use_sot is on; pass include_reasoning=False to skip it.
+    """
+    if include_reasoning is None:
+        include_reasoning = use_sot
+    kwargs = {'include_reasoning': include_reasoning} if _SUPPORTS_INCLUDE_REASONING else {}
+    
+    # Without RAG, skip all document handling and analyze the message directly
+    if not use_rag:
+        result = direct_analyze_text(message, mode, use_sot, **kwargs)
+        return _build_chat_response(message, result, [])
+    
+    # Get document content for RAG
+    document_manager = get_document_manager()
+    
+    if document_context:
+        # Ensure documents in context have content, loading all missing ones in one call
+        missing = [doc["document_id"] for doc in document_context
+                   if "document_id" in doc and "content" not in doc]
+        contents = document_manager.get_document_contents_bulk(missing) if missing else {}
+        for doc in document_context:
+            content = contents.get(doc.get("document_id"))
+            if content and "content" not in doc:
+                doc["content"] = content
+                doc["relevance"] = 0.95  # High relevance for manually selected docs
+    else:
+        # If no specific documents provided, automatically retrieve relevant ones
+        document_context = document_manager.get_documents_for_rag(message, limit=3)
+        if document_context:
+            logger.info(f"Retrieved {len(document_context)} relevant documents for RAG")
+    
+    # Process with direct integration, handling document context
+    if _SUPPORTS_DOCUMENT_CONTEXT:
+        result = direct_analyze_text(message, mode, use_sot, document_context=document_context, **kwargs)
+    else:
+        result = direct_analyze_text(message, mode, use_sot, **kwargs)
+        
+        # Add document context to the result manually
+        result["document_context"] = document_context
+    
+    return _build_chat_response(message, result, document_context)
 
 #
 # Updates for direct_integration.py
 #
 
-def improved_direct_analyze_text(text, mode='standard', use_sot=True, document_context=None):
+def _document_cache_key(doc):
+    """Identify a context document by its filename and a hash of the text the analysis uses from it."""
+    content = doc.get("snippet") or doc.get("content") or ""
+    return doc.get("filename"), hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def _get_cached_analysis(key):
+    """Return a deep copy of a cached analysis result, or None if not cached."""
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(key)
+        if cached is None:
+            return None
+        _analysis_cache.move_to_end(key)
+        return copy.deepcopy(cached)
+
+def _store_cached_analysis(key, result):
+    """
+    Cache a deep copy of an analysis result, evicting the least recently used entries.
+    The document context is left out; callers add their own.
+    """
+    stored = copy.deepcopy({k: v for k, v in result.items() if k != 'document_context'})
+    with _analysis_cache_lock:
+        _analysis_cache[key] = stored
+        _analysis_cache.move_to_end(key)
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+
+def _generate_questions_and_reasoning(clarifier, analysis_text, issues, use_sot):
+    """Run the clarifier's question and reasoning generation concurrently."""
+    questions = _EXECUTOR.submit(clarifier.generate_questions, analysis_text, issues, use_sot=use_sot)
+    reasoning = _EXECUTOR.submit(clarifier.generate_reasoning, analysis_text, issues)
+    return questions.result(), reasoning.result()
+
+def improved_direct_analyze_text(text, mode='standard', use_sot=True, document_context=None, include_reasoning=True):
     """
     Improved version of direct_analyze_text that properly handles document context.
     This should replace or be integrated into the existing function in direct_integration.py.
@@ -146,26 +208,40 @@ def improved_direct_analyze_text(text, mode='standard', use_sot=True, document_c
     
     try:
         # Get the clarifier instance
-        from flask import current_app
         clarifier = current_app.clarifier
         
-        # Prepare context from documents if available
-        context = ""
+        # Reuse the result of an identical earlier request (retries, refreshes).
+        # Documents are keyed by content, so edited documents miss the cache, and
+        # the model is part of the key so a model change invalidates old entries.
+        cache_key = (
+            text,
+            mode,
+            use_sot,
+            include_reasoning,
+            tuple(_document_cache_key(doc) for doc in document_context or []),
+            clarifier.get_model_info().get('model', 'unknown')
+        )
+        cached = _get_cached_analysis(cache_key)
+        if cached is not None:
+            cached['document_context'] = result['document_context']
+            return cached
+        
+        # Build the analysis text, prepending context from documents if available
+        analysis_text = text
         if document_context:
-            context = "Context from documents:\n\n"
+            parts = ["Context from documents:\n\n"]
             for i, doc in enumerate(document_context):
-                if "content" in doc and doc["content"]:
+                # Prefer the snippet stored in the document index at ingest time
+                content = doc.get("snippet")
+                if not content and doc.get("content"):
                     content = doc["content"]
                     # Truncate if too long
                     if len(content) > 1000:
                         content = content[:1000] + "..."
-                    context += f"Document {i+1} ({doc.get('filename', 'unnamed')}): {content}\n\n"
-        
-        # Add context to the text if available
-        analysis_text = text
-        if context:
-            # Prepend context for analysis
-            analysis_text = f"{context}\n\nUser query: {text}"
+                if content:
+                    parts.append(f"Document {i+1} ({doc.get('filename', 'unnamed')}): {content}\n\n")
+            parts.append(f"\n\nUser query: {text}")
+            analysis_text = "".join(parts)
         
         # Analyze the text
         if mode == 'deep':
@@ -175,18 +251,17 @@ def improved_direct_analyze_text(text, mode='standard', use_sot=True, document_c
             # Use standard mode
             issues = clarifier.analyze(analysis_text)
         
-        # Generate Socratic questions based on the issues
+        # Generate Socratic questions based on the issues, and reasoning if SoT is enabled
+        # and the caller uses it. Both only depend on the issues, so they run concurrently.
         questions = []
-        if issues:
-            questions = clarifier.generate_questions(analysis_text, issues, use_sot=use_sot)
-        
-        # Generate reasoning if SoT is enabled
         reasoning = ""
         sot_paradigm = None
-        if use_sot and issues:
-            reasoning_result = clarifier.generate_reasoning(analysis_text, issues)
+        if issues and use_sot and include_reasoning:
+            questions, reasoning_result = _generate_questions_and_reasoning(clarifier, analysis_text, issues, use_sot)
             reasoning = reasoning_result.get('reasoning', '')
             sot_paradigm = reasoning_result.get('paradigm')
+        elif issues:
+            questions = clarifier.generate_questions(analysis_text, issues, use_sot=use_sot)
         
         # Update the result
         result.update({
@@ -199,12 +274,11 @@ def improved_direct_analyze_text(text, mode='standard', use_sot=True, document_c
             'provider': clarifier.get_model_info().get('provider', 'unknown')
         })
         
+        _store_cached_analysis(cache_key, result)
         return result
     except Exception as e:
         # Log the error and return a basic result
-        from loguru import logger
-        import traceback
-        logger.error(f"Error in direct_analyze_text: {e}\n{traceback.format_exc()}")
+        logger.opt(exception=True).error(f"Error in direct_analyze_text: {e}")
         
         # Include error in result
         result['error'] = str(e)
@@ -8,10 +8,28 @@ Script to apply fixes to the AI-Socratic-Clarifier:
 
 import os
 import sys
+import copy
 import shutil
 import logging
 import json
+import functools
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson is optional; config.json falls back to the stdlib json module
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# requests is optional; the Ollama model checks are skipped without it
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    REQUESTS_AVAILABLE = True
+except ImportError:
+    REQUESTS_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -21,86 +39,156 @@ logger = logging.getLogger(__name__)
 script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_dir)
 
+# Directories the UI fixes work in
+WEB_DIR = os.path.join(script_dir, "web_interface")
+TEMPLATES_DIR = os.path.join(WEB_DIR, "templates")
+COMPONENTS_DIR = os.path.join(TEMPLATES_DIR, "components")
+ENHANCED_JS_DIR = os.path.join(WEB_DIR, "static", "js", "enhanced")
+STORAGE_DIR = os.path.join(script_dir, "document_storage")
+
+# Shared session so the Ollama requests reuse one connection
+if REQUESTS_AVAILABLE:
+    _SESSION = requests.Session()
+    _SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 def backup_file(file_path):
-    """Create a backup of a file with .bak extension."""
+    """
+    Create a backup of a file with .bak extension.
+    The backup is a hard link where possible, so the file must then be
+    replaced (see replace_file) rather than rewritten in place.
+    Symlinks are followed, so the backup is taken next to the file they point to.
+    """
+    file_path = os.path.realpath(file_path)
     if os.path.exists(file_path):
         backup_path = f"{file_path}.bak"
         logger.info(f"Creating backup of {file_path} to {backup_path}")
-        shutil.copy2(file_path, backup_path)
+        try:
+            os.remove(backup_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(file_path, backup_path)
+        except OSError:
+            # Cross-device or no hard link support
+            shutil.copy2(file_path, backup_path)
         return True
     return False
 
+def replace_file(src_file, dst_file):
+    """
+    Replace dst_file with a copy of src_file, leaving hard-linked backups intact.
+    Symlinks are followed, so the file they point to is replaced rather than the link.
+    """
+    dst_file = os.path.realpath(dst_file)
+    tmp_file = f"{dst_file}.tmp"
+    shutil.copyfile(src_file, tmp_file)
+    os.replace(tmp_file, dst_file)
+
+@functools.lru_cache(maxsize=1)
+def _load_config_cached(config_path, mtime):
+    if ORJSON_AVAILABLE:
+        with open(config_path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+def load_config(config_path):
+    """
+    Load a config file, reparsing it only when its mtime changes.
+    Returns a copy, so callers are free to modify it.
+    """
+    return copy.deepcopy(_load_config_cached(config_path, os.path.getmtime(config_path)))
+
+def save_config(config_path, config):
+    """Write a config file indented by 2, with orjson when available."""
+    if ORJSON_AVAILABLE:
+        with open(config_path, 'wb') as f:
+            f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+    else:
+        with open(config_path, 'w') as f:
+            json.dump(config, f, indent=2)
+
+def _list_dir(path):
+    """Return the names of the entries in a directory, or an empty set if it is missing."""
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return set()
+
 def apply_ui_fixes():
     """Apply UI fixes for the duplicate navbar and document management."""
     logger.info("Applying UI fixes...")
     
+    os.makedirs(COMPONENTS_DIR, exist_ok=True)
+    
+    # List the directories once so the checks below are set lookups
+    web_files = _list_dir(WEB_DIR)
+    template_files = _list_dir(TEMPLATES_DIR)
+    component_files = _list_dir(COMPONENTS_DIR)
+    enhanced_js_files = _list_dir(ENHANCED_JS_DIR)
+    
     # Copy the fixed app.py
-    src_file = os.path.join(script_dir, "web_interface", "fixed_app.py")
-    dst_file = os.path.join(script_dir, "web_interface", "app.py")
-    if os.path.exists(src_file):
+    src_file = os.path.join(WEB_DIR, "fixed_app.py")
+    dst_file = os.path.join(WEB_DIR, "app.py")
+    if "fixed_app.py" in web_files:
         backup_file(dst_file)
-        shutil.copy2(src_file, dst_file)
+        replace_file(src_file, dst_file)
         logger.info(f"Applied app.py fixes (replaced with fixed_app.py)")
     else:
         logger.error(f"Fixed app file not found: {src_file}")
 
     # Copy the fixed integrated UI template
-    src_file = os.path.join(script_dir, "web_interface", "templates", "fixed_integrated_ui.html")
-    os.makedirs(os.path.join(script_dir, "web_interface", "templates"), exist_ok=True)
-    dst_file = os.path.join(script_dir, "web_interface", "templates", "integrated_ui.html")
-    if os.path.exists(src_file):
+    src_file = os.path.join(TEMPLATES_DIR, "fixed_integrated_ui.html")
+    dst_file = os.path.join(TEMPLATES_DIR, "integrated_ui.html")
+    if "fixed_integrated_ui.html" in template_files:
         backup_file(dst_file)
-        shutil.copy2(src_file, dst_file)
+        replace_file(src_file, dst_file)
         logger.info(f"Applied integrated UI template fixes")
     else:
         logger.error(f"Fixed integrated UI template not found: {src_file}")
 
     # Copy the document preview modal
-    os.makedirs(os.path.join(script_dir, "web_interface", "templates", "components"), exist_ok=True)
-    src_file = os.path.join(script_dir, "web_interface", "templates", "components", "document_preview_modal.html")
-    dst_file = os.path.join(script_dir, "web_interface", "templates", "components", "document_preview_modal.html")
-    if os.path.exists(src_file):
+    src_file = os.path.join(COMPONENTS_DIR, "document_preview_modal.html")
+    dst_file = os.path.join(COMPONENTS_DIR, "document_preview_modal.html")
+    if "document_preview_modal.html" in component_files:
         logger.info(f"Document preview modal template already exists")
     else:
         logger.error(f"Document preview modal template not found: {src_file}")
 
     # Copy the document manager with delete functionality
-    src_file = os.path.join(script_dir, "web_interface", "static", "js", "enhanced", "document_manager_delete.js")
-    dst_file = os.path.join(script_dir, "web_interface", "static", "js", "enhanced", "document_manager.js")
-    if os.path.exists(src_file):
+    src_file = os.path.join(ENHANCED_JS_DIR, "document_manager_delete.js")
+    dst_file = os.path.join(ENHANCED_JS_DIR, "document_manager.js")
+    if "document_manager_delete.js" in enhanced_js_files:
         backup_file(dst_file)
-        shutil.copy2(src_file, dst_file)
+        replace_file(src_file, dst_file)
         logger.info(f"Applied document manager fixes for delete functionality")
     else:
         logger.error(f"Fixed document manager file not found: {src_file}")
     
     # Copy the fixed document_rag_routes.py
-    src_file = os.path.join(script_dir, "web_interface", "fixed_document_rag_routes.py")
-    dst_file = os.path.join(script_dir, "web_interface", "document_rag_routes.py")
-    if os.path.exists(src_file):
+    src_file = os.path.join(WEB_DIR, "fixed_document_rag_routes.py")
+    dst_file = os.path.join(WEB_DIR, "document_rag_routes.py")
+    if "fixed_document_rag_routes.py" in web_files:
         backup_file(dst_file)
-        shutil.copy2(src_file, dst_file)
+        replace_file(src_file, dst_file)
         logger.info(f"Applied document_rag_routes.py fixes for document deletion")
     else:
         logger.error(f"Fixed document routes file not found: {src_file}")
         
-    # Copy the fixed settings routes
-    src_file = os.path.join(script_dir, "web_interface", "fixed_settings_routes.py")
-    dst_file = os.path.join(script_dir, "web_interface", "fixed_settings_routes.py")
-    if not os.path.exists(dst_file) and os.path.exists(src_file):
-        shutil.copy2(src_file, dst_file)
-        logger.info(f"Applied settings routes fixes")
-    else:
+    # Check the fixed settings routes, which are used in place
+    src_file = os.path.join(WEB_DIR, "fixed_settings_routes.py")
+    if "fixed_settings_routes.py" in web_files:
         logger.info(f"Settings routes already exist")
-    
-    # Copy the fixed settings page template
-    src_file = os.path.join(script_dir, "web_interface", "templates", "fixed_settings_page.html")
-    dst_file = os.path.join(script_dir, "web_interface", "templates", "fixed_settings_page.html")
-    if not os.path.exists(dst_file) and os.path.exists(src_file):
-        shutil.copy2(src_file, dst_file)
-        logger.info(f"Applied settings page template fixes")
     else:
+        logger.error(f"Fixed settings routes not found: {src_file}")
+    
+    # Check the fixed settings page template, which is used in place
+    src_file = os.path.join(TEMPLATES_DIR, "fixed_settings_page.html")
+    if "fixed_settings_page.html" in template_files:
         logger.info(f"Settings page template already exists")
+    else:
+        logger.error(f"Fixed settings page template not found: {src_file}")
 
 def check_vector_db_setup():
     """Check if the vector database is properly set up."""
@@ -113,8 +201,7 @@ def check_vector_db_setup():
         return False
     
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = load_config(config_path)
         
         config_updated = False
         
@@ -138,27 +225,29 @@ def check_vector_db_setup():
                 
             # Save config if updated
             if config_updated:
-                with open(config_path, 'w') as f:
-                    json.dump(config, f, indent=4)
+                save_config(config_path, config)
                 
                 # Check if Ollama is available and try to pull the models
                 try:
-                    import requests
+                    if not REQUESTS_AVAILABLE:
+                        raise ImportError("requests is not installed")
+                    
+                    # Fetch the installed models once for both checks
+                    response = _SESSION.get("http://localhost:11434/api/tags", timeout=2)
+                    model_names = frozenset()
+                    if response.status_code == 200:
+                        model_names = frozenset(model.get("name") for model in response.json().get("models", ()))
                     
                     # Check for embedding model
                     embedding_model = config['integrations']['ollama']['default_embedding_model']
                     try:
                         logger.info(f"Checking if embedding model {embedding_model} exists...")
-                        response = requests.get("http://localhost:11434/api/tags")
                         if response.status_code == 200:
                             # Check if the embedding model exists
-                            models = response.json().get("models", [])
-                            model_names = [model.get("name") for model in models]
-                            
                             if embedding_model not in model_names:
                                 logger.info(f"Embedding model not found in Ollama. Pulling {embedding_model}...")
                                 # Try to pull the model
-                                pull_response = requests.post(
+                                pull_response = _SESSION.post(
                                     "http://localhost:11434/api/pull",
                                     json={"name": embedding_model}
                                 )
@@ -177,16 +266,12 @@ def check_vector_db_setup():
                     multimodal_model = config['integrations']['ollama']['multimodal_model']
                     try:
                         logger.info(f"Checking if multimodal model {multimodal_model} exists...")
-                        response = requests.get("http://localhost:11434/api/tags")
                         if response.status_code == 200:
                             # Check if the multimodal model exists
-                            models = response.json().get("models", [])
-                            model_names = [model.get("name") for model in models]
-                            
                             if multimodal_model not in model_names:
                                 logger.info(f"Multimodal model not found in Ollama. Pulling {multimodal_model}...")
                                 # Try to pull the model
-                                pull_response = requests.post(
+                                pull_response = _SESSION.post(
                                     "http://localhost:11434/api/pull",
                                     json={"name": multimodal_model}
                                 )
@@ -217,7 +302,7 @@ def ensure_document_storage():
     """Ensure document storage directories exist."""
     logger.info("Setting up document storage directories...")
     
-    storage_base = os.path.join(script_dir, "document_storage")
+    storage_base = STORAGE_DIR
     
     # Create main storage directory
     os.makedirs(storage_base, exist_ok=True)
@@ -246,7 +331,7 @@ def cleanup_document_index():
     logger.info("Cleaning up document index...")
     
     # Get document index file path
-    index_file = os.path.join(script_dir, "document_storage", "document_index.json")
+    index_file = os.path.join(STORAGE_DIR, "document_index.json")
     if not os.path.exists(index_file):
         logger.error(f"Document index file not found: {index_file}")
         return False
@@ -256,28 +341,40 @@ def cleanup_document_index():
     
     # Load document index
     try:
-        with open(index_file, 'r') as f:
-            index_data = json.load(f)
+        if ORJSON_AVAILABLE:
+            with open(index_file, 'rb') as f:
+                index_data = orjson.loads(f.read())
+        else:
+            with open(index_file, 'r') as f:
+                index_data = json.load(f)
         
         documents = index_data.get("documents", [])
         original_count = len(documents)
-        valid_documents = []
         
-        # Check each document
-        for doc in documents:
-            file_path = doc.get("file_path")
-            # Skip documents with None or invalid file paths
-            if file_path and os.path.exists(file_path):
-                valid_documents.append(doc)
-            else:
-                logger.info(f"Removing invalid document entry: {doc.get('id')} - {doc.get('filename', 'unknown')}")
+        # Check the document files in parallel; each stat waits on the filesystem
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            exists = list(executor.map(os.path.exists, [doc.get("file_path") or "" for doc in documents]))
+        
+        # Skip documents with None or invalid file paths
+        valid_documents = [doc for doc, file_exists in zip(documents, exists) if file_exists]
+        invalid_entries = [f"{doc.get('id')} - {doc.get('filename', 'unknown')}"
+                           for doc, file_exists in zip(documents, exists) if not file_exists]
+        
+        if invalid_entries:
+            logger.info("Removing invalid document entries: %s", "; ".join(invalid_entries))
         
         # Update index with valid documents only
         index_data["documents"] = valid_documents
         
-        # Save updated index
-        with open(index_file, 'w') as f:
-            json.dump(index_data, f, indent=2)
+        # Save updated index as a new file so the linked backup keeps the old one
+        tmp_file = f"{index_file}.tmp"
+        if ORJSON_AVAILABLE:
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(index_data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(tmp_file, 'w') as f:
+                json.dump(index_data, f, indent=2)
+        os.replace(tmp_file, index_file)
         
         logger.info(f"Cleaned up document index - removed {original_count - len(valid_documents)} invalid entries")
         return True
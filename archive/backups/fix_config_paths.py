@@ -12,6 +12,7 @@ import glob
 import re
 import logging
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -20,20 +21,32 @@ logger = logging.getLogger(__name__)
 # Get the project root directory
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = script_dir
+ARCHIVE_DIR = os.path.join(project_root, 'archive')
 
-def backup_file(file_path):
-    """Create a backup of a file with .bak extension."""
-    if os.path.exists(file_path):
-        backup_path = f"{file_path}.config_path_fix_bak"
-        logger.info(f"Creating backup of {file_path} to {backup_path}")
-        shutil.copy2(file_path, backup_path)
-        return True
-    return False
+# Directories that never contain project sources
+SKIP_DIRS = {'venv', '.venv', '.git', 'node_modules', '__pycache__'}
+
+# Path constructions that point at config.json inside archive/ or fixes/.
+# Files are matched as bytes; the patterns are ASCII so no decoding is needed.
+CONFIG_EXPRESSIONS = [re.compile(expr) for expr in (
+    rb"os\.path\.join\(\s*os\.path\.dirname\(__file__\),\s*['\"]archive['\"],\s*['\"]fixes['\"],\s*['\"]config\.json['\"]\s*\)",
+    rb"os\.path\.join\(\s*os\.path\.dirname\(__file__\),\s*['\"]archive['\"],\s*['\"]config\.json['\"]\s*\)",
+    rb"os\.path\.join\(\s*os\.path\.dirname\(__file__\),\s*['\"]fixes['\"],\s*['\"]config\.json['\"]\s*\)",
+)]
+
+def backup_file(file_path, original_content):
+    """Write the original content of a file to a .config_path_fix_bak backup."""
+    backup_path = f"{file_path}.config_path_fix_bak"
+    logger.info(f"Creating backup of {file_path} to {backup_path}")
+    with open(backup_path, 'wb') as f:
+        f.write(original_content)
 
 def find_py_files(directory):
     """Find all Python files in the given directory and its subdirectories."""
     py_files = []
-    for root, _, files in os.walk(directory):
+    for root, dirs, files in os.walk(directory):
+        # Don't descend into environments, VCS metadata or caches
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
         for file in files:
             if file.endswith('.py'):
                 py_files.append(os.path.join(root, file))
@@ -42,66 +55,42 @@ def find_py_files(directory):
 def fix_config_paths_in_file(file_path):
     """Fix config paths in the given file."""
     try:
-        with open(file_path, 'r') as f:
+        with open(file_path, 'rb') as f:
             content = f.read()
         
-        original_content = content
-        changes_made = False
+        # Most files never mention config.json, so skip them before any pattern work
+        if b"config.json" not in content:
+            return False
         
-        # Fix hardcoded paths to config.json
-        hardcoded_paths = [
-            "config.json",
-            "config.json",
-            "config.json",
-            "config.json",
-        ]
+        original_content = content
+        fixed_count = 0
         
-        for path in hardcoded_paths:
-            if path in content:
-                content = content.replace(path, "../config.json" if "archive" in file_path else "config.json")
-                changes_made = True
-                logger.info(f"Fixed hardcoded config path in {file_path}")
+        # Fix hardcoded paths to config.json; files outside archive already use the right one
+        if "archive" in file_path:
+            content = content.replace(b"config.json", b"../config.json")
+            fixed_count += 1
         
         # Fix complex path constructions
-        config_expressions = [
-            r"os\.path\.join\(\s*os\.path\.dirname\(__file__\),\s*['\"]archive['\"],\s*['\"]fixes['\"],\s*['\"]config\.json['\"]\s*\)",
-            r"os\.path\.join\(\s*os\.path\.dirname\(__file__\),\s*['\"]archive['\"],\s*['\"]config\.json['\"]\s*\)",
-            r"os\.path\.join\(\s*os\.path\.dirname\(__file__\),\s*['\"]fixes['\"],\s*['\"]config\.json['\"]\s*\)",
-        ]
-        
-        for expr in config_expressions:
-            matches = re.findall(expr, content)
-            for match in matches:
-                # Replace with a reference to config.json in project root
-                if "archive" in file_path:
-                    # If the file is in archive, go back to project root
-                    replacement = "os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')"
-                else:
-                    # If the file is already in project root
-                    replacement = "os.path.join(os.path.dirname(__file__), 'config.json')"
-                
-                content = content.replace(match, replacement)
-                changes_made = True
-                logger.info(f"Fixed config path expression in {file_path}")
-        
-        # Fix loading ecosystem state
-        ecosystem_state_paths = [
-            "sequential_thinking/ecosystem_state.json",
-            "sequential_thinking/ecosystem_state.json"
-        ]
+        if "archive" in file_path:
+            # If the file is in archive, go back to project root
+            replacement = b"os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')"
+        else:
+            # If the file is already in project root
+            replacement = b"os.path.join(os.path.dirname(__file__), 'config.json')"
         
-        for path in ecosystem_state_paths:
-            if path in content:
-                content = content.replace(path, "sequential_thinking/ecosystem_state.json")
-                changes_made = True
-                logger.info(f"Fixed ecosystem state path in {file_path}")
+        for pattern in CONFIG_EXPRESSIONS:
+            # Replace with a reference to config.json in project root
+            content, count = pattern.subn(lambda match: replacement, content)
+            fixed_count += count
         
         # Write back if changes were made
-        if changes_made:
-            # Backup the original file
-            backup_file(file_path)
+        if fixed_count:
+            logger.info("Fixed %d config paths in %s", fixed_count, file_path)
             
-            with open(file_path, 'w') as f:
+            # Backup the original file from the content already read
+            backup_file(file_path, original_content)
+            
+            with open(file_path, 'wb') as f:
                 f.write(content)
             
             return True
@@ -121,16 +110,25 @@ def copy_config_to_needed_locations():
         return False
     
     # Copy to archive directory
-    archive_config = os.path.join(project_root, 'archive', 'config.json')
-    archive_fixes_config = os.path.join(project_root, 'archive', 'fixes', 'config.json')
+    archive_config = os.path.join(ARCHIVE_DIR, 'config.json')
+    archive_fixes_config = os.path.join(ARCHIVE_DIR, 'fixes', 'config.json')
     
     os.makedirs(os.path.dirname(archive_config), exist_ok=True)
     os.makedirs(os.path.dirname(archive_fixes_config), exist_ok=True)
     
-    shutil.copy2(config_path, archive_config)
-    shutil.copy2(config_path, archive_fixes_config)
+    # Hard-link the copies so all three paths share the root config
+    for dst in (archive_config, archive_fixes_config):
+        try:
+            os.remove(dst)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(config_path, dst)
+        except OSError:
+            # Cross-device or no hard link support
+            shutil.copyfile(config_path, dst)
     
-    logger.info(f"Copied config.json to archive directories")
+    logger.info(f"Linked config.json into archive directories")
     return True
 
 def fix_all_config_paths():
@@ -139,16 +137,10 @@ def fix_all_config_paths():
     py_files = find_py_files(project_root)
     
     total_files = len(py_files)
-    fixed_files = 0
     
-    for file_path in py_files:
-        # Skip the venv directory
-        if 'venv/' in file_path:
-            continue
-        
-        # Fix config paths in the file
-        if fix_config_paths_in_file(file_path):
-            fixed_files += 1
+    # Fix config paths in the files, spread across processes
+    with ProcessPoolExecutor() as executor:
+        fixed_files = sum(executor.map(fix_config_paths_in_file, py_files, chunksize=64))
     
     # Copy config.json to needed locations
     copy_config_to_needed_locations()
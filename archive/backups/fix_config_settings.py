@@ -11,173 +11,194 @@ import json
 import logging
 import shutil
 import sys
+import copy
+import hashlib
+import difflib
+import argparse
+import functools
+from pathlib import Path
+
+# orjson is optional; the stdlib json module is used without it
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# jsonschema is optional; without it defaults are still applied but types are not checked
+try:
+    from jsonschema import Draft202012Validator
+    JSONSCHEMA_AVAILABLE = True
+except ImportError:
+    JSONSCHEMA_AVAILABLE = False
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.schema.json")
+
+# Repository root (this script lives in archive/backups)
+REPO = Path(__file__).resolve().parents[2]
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def fix_config_settings():
-    """Fix SRE and SoT configuration settings."""
-    config_path = os.path.join("/home/ty/Repositories/ai_workspace/ai-socratic-clarifier", "config.json")
+def load_json(path):
+    """Load a JSON file, with orjson when available."""
+    if ORJSON_AVAILABLE:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_json(path, data):
+    """
+    Write a JSON file atomically, indented by 2, with orjson when available.
+    The data goes to a temporary file that then replaces path, so a crash
+    never leaves a truncated file behind.
+    """
+    if ORJSON_AVAILABLE:
+        content = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        content = json.dumps(data, indent=2).encode('utf-8')
+    
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+@functools.lru_cache(maxsize=1)
+def load_schema():
+    """Load config.schema.json once."""
+    return load_json(SCHEMA_PATH)
+
+@functools.lru_cache(maxsize=1)
+def _validator():
+    return Draft202012Validator(load_schema())
+
+def apply_schema_defaults(instance, schema):
+    """Fill in missing properties from the schema's defaults, keeping existing values."""
+    for name, subschema in schema.get('properties', {}).items():
+        if 'default' in subschema:
+            instance.setdefault(name, copy.deepcopy(subschema['default']))
+        if isinstance(instance.get(name), dict):
+            apply_schema_defaults(instance[name], subschema)
+
+def config_digest(config):
+    """BLAKE2b digest of a config's canonical (key-sorted) JSON encoding."""
+    if ORJSON_AVAILABLE:
+        data = orjson.dumps(config, option=orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(config, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(data).digest()
+
+@functools.lru_cache(maxsize=1)
+def _default_state_bytes():
+    """The default ecosystem state, read once from default_ecosystem_state.json."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_ecosystem_state.json"), 'rb') as f:
+        return f.read()
+
+def fix_config_settings(dry_run=False):
+    """
+    Fix SRE and SoT configuration settings.
+    With dry_run, nothing is written; the config changes are logged as a diff.
+    """
+    config_path = REPO / "config.json"
+    config_source = config_path
     
     if not os.path.exists(config_path):
         logger.error(f"Config file not found at: {config_path}")
         
         # Try to use the example config as a base
-        example_path = os.path.join("/home/ty/Repositories/ai_workspace/ai-socratic-clarifier", "config.example.json")
+        example_path = REPO / "config.example.json"
         if os.path.exists(example_path):
             logger.info(f"Using example config from: {example_path}")
-            shutil.copy2(example_path, config_path)
+            if dry_run:
+                config_source = example_path
+            else:
+                shutil.copy2(example_path, config_path)
         else:
             logger.error("No example config found. Cannot continue.")
             return False
     
-    # Backup the config file
-    backup_path = f"{config_path}.settings_fix_bak"
-    logger.info(f"Creating backup to {backup_path}")
-    shutil.copy2(config_path, backup_path)
-    
     try:
         # Load the current config
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-        
-        # Make sure 'settings' section exists
-        if 'settings' not in config:
-            config['settings'] = {}
-        
-        # Fix SRE settings
-        logger.info("Applying SRE settings...")
-        config['settings']['sre_global_resonance'] = config['settings'].get('sre_global_resonance', 0.8)
-        config['settings']['sre_adaptive_flexibility'] = config['settings'].get('sre_adaptive_flexibility', 0.5)
-        config['settings']['use_sre_visualization'] = config['settings'].get('use_sre_visualization', True)
-        config['settings']['auto_expand_sre'] = config['settings'].get('auto_expand_sre', True)
+        config = load_json(config_source)
+        original_digest = config_digest(config)
+        if dry_run:
+            original_lines = json.dumps(config, indent=2).splitlines()
         
-        # Fix SoT settings
-        logger.info("Applying SoT settings...")
-        if 'sot' not in config['settings']:
-            config['settings']['sot'] = {}
-        
-        config['settings']['sot']['default_paradigm'] = config['settings']['sot'].get('default_paradigm', 'auto')
-        config['settings']['use_sot'] = config['settings'].get('use_sot', True)
-        config['settings']['use_llm_questions'] = config['settings'].get('use_llm_questions', True)
-        config['settings']['use_llm_reasoning'] = config['settings'].get('use_llm_reasoning', True)
-        
-        # Ensure both SRE and SoT ecosystem paths are correct
-        if 'ecosystem_state_path' not in config['settings']:
-            config['settings']['ecosystem_state_path'] = 'sequential_thinking/ecosystem_state.json'
+        # Fill in missing SRE and SoT settings from the schema, keeping existing values
+        logger.info("Applying SRE and SoT settings...")
+        apply_schema_defaults(config, load_schema())
+        if JSONSCHEMA_AVAILABLE:
+            for error in _validator().iter_errors(config):
+                logger.warning(f"Invalid config setting {'.'.join(map(str, error.path))}: {error.message}")
         
         # Add ecosystem state path for both locations
-        sequential_thinking_dir = os.path.join("/home/ty/Repositories/ai_workspace/ai-socratic-clarifier", "sequential_thinking")
-        archive_dir = os.path.join("/home/ty/Repositories/ai_workspace/ai-socratic-clarifier", "archive", "fixes", "sequential_thinking")
+        sequential_thinking_dir = REPO / "sequential_thinking"
+        archive_dir = REPO / "archive" / "fixes" / "sequential_thinking"
         
         # Create directories if needed
-        os.makedirs(sequential_thinking_dir, exist_ok=True)
-        os.makedirs(archive_dir, exist_ok=True)
+        if not dry_run:
+            os.makedirs(sequential_thinking_dir, exist_ok=True)
+            os.makedirs(archive_dir, exist_ok=True)
         
         # Copy ecosystem state to both locations if needed
-        ecosystem_state = os.path.join(sequential_thinking_dir, "ecosystem_state.json")
-        archive_ecosystem_state = os.path.join(archive_dir, "ecosystem_state.json")
+        ecosystem_state = sequential_thinking_dir / "ecosystem_state.json"
+        archive_ecosystem_state = archive_dir / "ecosystem_state.json"
+        
+        # Check each location once
+        state_exists = os.path.exists(ecosystem_state)
+        archive_state_exists = os.path.exists(archive_ecosystem_state)
         
         # If one location has the file but not the other, copy it
-        if os.path.exists(ecosystem_state) and not os.path.exists(archive_ecosystem_state):
+        if state_exists and not archive_state_exists:
             logger.info(f"Copying ecosystem state to archive...")
-            shutil.copy2(ecosystem_state, archive_ecosystem_state)
-        elif os.path.exists(archive_ecosystem_state) and not os.path.exists(ecosystem_state):
+            if not dry_run:
+                shutil.copy2(ecosystem_state, archive_ecosystem_state)
+        elif archive_state_exists and not state_exists:
             logger.info(f"Copying ecosystem state from archive...")
-            shutil.copy2(archive_ecosystem_state, ecosystem_state)
+            if not dry_run:
+                shutil.copy2(archive_ecosystem_state, ecosystem_state)
         # If neither location has the file, create a default one
-        elif not os.path.exists(ecosystem_state) and not os.path.exists(archive_ecosystem_state):
+        elif not state_exists and not archive_state_exists:
             logger.info("Creating default ecosystem state...")
             
-            # Create a default ecosystem state
-            default_state = {
-                "nodes": {
-                    "conceptual_chaining": {
-                        "id": "conceptual_chaining",
-                        "name": "Conceptual Chaining",
-                        "count": 0,
-                        "success_count": 0
-                    },
-                    "chunked_symbolism": {
-                        "id": "chunked_symbolism",
-                        "name": "Chunked Symbolism", 
-                        "count": 0,
-                        "success_count": 0
-                    },
-                    "expert_lexicons": {
-                        "id": "expert_lexicons",
-                        "name": "Expert Lexicons",
-                        "count": 0,
-                        "success_count": 0
-                    }
-                },
-                "global_coherence": 0.8,
-                "question_history": [],
-                "meta_meta_framework": {
-                    "principle_of_inquiry": "Improve critical thinking through effective Socratic questioning",
-                    "dimensional_axes": {
-                        "reasoning_approach": {
-                            "description": "Reasoning approach to use",
-                            "values": ["conceptual_chaining", "chunked_symbolism", "expert_lexicons", "socratic_questioning"]
-                        },
-                        "question_focus": {
-                            "description": "Focus area for generated questions",
-                            "values": ["definitions", "evidence", "assumptions", "implications", "alternatives"]
-                        },
-                        "complexity_level": {
-                            "description": "Complexity level of exploration",
-                            "values": ["simple", "moderate", "complex"]
-                        }
-                    },
-                    "constraints": [
-                        {"constraint": "Questions must be genuinely helpful", "purpose": "Ensure practical value"},
-                        {"constraint": "Questions must address specific issues", "purpose": "Maintain relevance"},
-                        {"constraint": "Questions should be open-ended", "purpose": "Encourage deeper thinking"}
-                    ],
-                    "controlled_emergence": 0.3,
-                    "feedback_loops": [
-                        {
-                            "name": "Question effectiveness",
-                            "metric": "user_feedback",
-                            "current_value": 0.5,
-                            "target_value": 0.8
-                        },
-                        {
-                            "name": "Reasoning coherence",
-                            "metric": "global_coherence",
-                            "current_value": 0.8,
-                            "target_value": 0.9
-                        },
-                        {
-                            "name": "Paradigm selection accuracy",
-                            "metric": "paradigm_accuracy",
-                            "current_value": 0.5,
-                            "target_value": 0.85
-                        }
-                    ],
-                    "adaptive_flexibility": 0.5
-                },
-                "intellisynth": {
-                    "truth_value": 0.7,
-                    "scrutiny_value": 0.0,
-                    "improvement_value": 0.0,
-                    "advancement": 0.0,
-                    "alpha": 0.5,
-                    "beta": 0.5
-                }
-            }
-            
-            # Write to both locations
-            with open(ecosystem_state, 'w') as f:
-                json.dump(default_state, f, indent=2)
-            
-            with open(archive_ecosystem_state, 'w') as f:
-                json.dump(default_state, f, indent=2)
+            # Write the default state once and link it into the archive
+            if not dry_run:
+                ecosystem_state.write_bytes(_default_state_bytes())
+                try:
+                    os.link(ecosystem_state, archive_ecosystem_state)
+                except OSError:
+                    archive_ecosystem_state.write_bytes(_default_state_bytes())
+        
+        # Leave the config file alone if no setting was added
+        if config_digest(config) == original_digest:
+            logger.info("Config settings already up to date")
+            return True
+        
+        if dry_run:
+            diff = difflib.unified_diff(original_lines, json.dumps(config, indent=2).splitlines(),
+                                        fromfile=str(config_source), tofile=str(config_path), lineterm="")
+            logger.info(f"Dry run, not writing {config_path}:\n" + "\n".join(diff))
+            return True
+        
+        # Backup the config file
+        backup_path = f"{config_path}.settings_fix_bak"
+        logger.info(f"Creating backup to {backup_path}")
+        try:
+            os.remove(backup_path)
+        except FileNotFoundError:
+            pass
+        try:
+            # save_json replaces the file, so a hard link keeps the old contents
+            os.link(config_path, backup_path)
+        except OSError:
+            shutil.copy2(config_path, backup_path)
         
         # Save the updated config
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=4)
+        save_json(config_path, config)
         
         logger.info("Successfully updated config settings")
         return True
@@ -187,8 +208,12 @@ def fix_config_settings():
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fix configuration settings for SRE and SoT integration")
+    parser.add_argument("--dry-run", action="store_true", help="log the changes without writing any files")
+    args = parser.parse_args()
+    
     try:
-        if fix_config_settings():
+        if fix_config_settings(dry_run=args.dry_run):
             logger.info("✨ Successfully fixed config settings")
         else:
             logger.error("❌ Failed to fix config settings")
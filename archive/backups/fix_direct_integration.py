@@ -6,21 +6,112 @@ This script properly modifies the file without causing syntax errors.
 
 import os
 import re
+import shutil
+import ast
+import difflib
+import argparse
+import itertools
 
-def fix_direct_integration():
-    """Enhance how document content is integrated into prompts in direct_integration.py."""
+SECTION_MARKER = "# Process any document context if provided"
+
+# The section as refactored to dispatch between the basic and advanced RAG
+# formatting; the improved formatting then lives in web_interface/rag_v2.py
+DELEGATING_SECTION_RE = re.compile(r"[ \t]*# Process any document context if provided\n[ \t]*document_text = build_document_text\(")
+
+# Section boundaries for files that don't parse: the next comment line, or a
+# blank line followed by code
+NEXT_SECTION_RE = re.compile(r"\n\s*# [^#\n]+")
+NEXT_CODE_BLOCK_RE = re.compile(r"\n\s*\n\s*[^#\s]")
+
+# Module-level config loader used by the improved section, added once
+RAG_CONFIG_LOADER = """import functools
+
+@functools.lru_cache(maxsize=4)
+def _load_rag_config(path, mtime):
+    \"\"\"Parse config.json for the document context settings, cached by path and mtime.\"\"\"
+    with open(path, 'rb') as f:
+        return json.loads(f.read())
+
+"""
+
+def _assigns_document_text(stmt):
+    """Whether a statement assigns document_text anywhere inside it."""
+    return any(isinstance(node, ast.Name) and node.id == "document_text" and isinstance(node.ctx, ast.Store)
+               for node in ast.walk(stmt))
+
+def find_section_end(content, section_start):
+    """
+    Find the end of the document context section with the AST.
+    The section is the run of statements after the marker comment that build
+    document_text, within the function containing the marker. Returns the
+    offset of the end of its last line, or None. Raises SyntaxError if the
+    file does not parse.
+    """
+    marker_line = content.count("\n", 0, section_start) + 1
+    functions = [node for node in ast.walk(ast.parse(content))
+                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+                 and node.lineno < marker_line <= node.end_lineno]
+    if not functions:
+        return None
+    
+    # The innermost function holding the marker
+    body = max(functions, key=lambda node: node.lineno).body
+    following = [stmt for stmt in body if stmt.lineno > marker_line]
+    section = list(itertools.takewhile(_assigns_document_text, following))
+    if not section:
+        return None
+    
+    lines = content.splitlines(keepends=True)
+    return len("".join(lines[:section[-1].end_lineno]).rstrip("\r\n"))
+
+def find_section_end_by_scan(content, section_start):
+    """Find the end of the document context section from the comments and blank lines after it."""
+    # Look for either the next function or the next top-level comment after our section
+    section_text = content[section_start:]
+    next_section_match = NEXT_SECTION_RE.search(section_text, 50)  # Skip a bit to avoid matching our own comment
+    
+    if next_section_match:
+        return section_start + next_section_match.start()
+    
+    # If no next section, look for lines that might be part of the next logic block
+    document_text_end = section_text.find("    prompt = f")
+    if document_text_end > 0:
+        return section_start + document_text_end
+    
+    # Fallback - just replace until we find a blank line followed by a non-comment, non-whitespace line
+    match = NEXT_CODE_BLOCK_RE.search(section_text)
+    if match:
+        return section_start + match.start()
+    return None
+
+def fix_direct_integration(dry_run=False):
+    """
+    Enhance how document content is integrated into prompts in direct_integration.py.
+    With dry_run, the file is left alone and the patch is printed as a diff.
+    """
     file_path = os.path.join('web_interface', 'direct_integration.py')
     
     if not os.path.exists(file_path):
         print(f"Error: {file_path} not found")
         return False
     
+    # Back up and replace the file a symlink points to rather than the link itself
+    real_path = os.path.realpath(file_path)
+    
     # Create a backup just to be safe
-    backup_path = f"{file_path}.safe_fix_bak"
+    backup_path = f"{real_path}.safe_fix_bak"
     try:
-        with open(file_path, 'r') as src, open(backup_path, 'w') as dst:
-            dst.write(src.read())
-        print(f"Created backup of {file_path} to {backup_path}")
+        if not dry_run:
+            try:
+                os.remove(backup_path)
+            except FileNotFoundError:
+                pass
+            try:
+                # The file is replaced below, never rewritten in place, so a hard link keeps the old contents
+                os.link(real_path, backup_path)
+            except OSError:
+                shutil.copyfile(real_path, backup_path)
+            print(f"Created backup of {file_path} to {backup_path}")
     except Exception as e:
         print(f"Error creating backup: {e}")
         return False
@@ -30,32 +121,24 @@ def fix_direct_integration():
         with open(file_path, 'r') as f:
             content = f.read()
         
-        # Find the section to replace - from the document context processing to the next major section
-        section_start = content.find("# Process any document context if provided")
+        # Find the section to replace - from the document context processing to the end of the statements building document_text
+        section_start = content.find(SECTION_MARKER)
         if section_start == -1:
             print("Could not find document context processing section")
             return False
         
-        # Find where to end the replacement
-        # Look for either the next function or the next top-level comment after our section
-        section_text = content[section_start:]
-        next_section_match = re.search(r"\n\s*# [^#\n]+", section_text[50:])  # Skip a bit to avoid matching our own comment
-        
-        if next_section_match:
-            section_end = section_start + 50 + next_section_match.start()
-        else:
-            # If no next section, look for lines that might be part of the next logic block
-            document_text_end = section_text.find("    prompt = f")
-            if document_text_end > 0:
-                section_end = section_start + document_text_end
-            else:
-                # Fallback - just replace until we find a blank line followed by a non-comment, non-whitespace line
-                match = re.search(r"\n\s*\n\s*[^#\s]", section_text)
-                if match:
-                    section_end = section_start + match.start()
-                else:
-                    print("Could not determine the end of the document context section")
-                    return False
+        if DELEGATING_SECTION_RE.match(content, content.rfind("\n", 0, section_start) + 1):
+            print(f"{file_path} already delegates to build_document_text; enable settings.advanced_rag in config.json instead")
+            return True
+        
+        try:
+            section_end = find_section_end(content, section_start)
+        except SyntaxError:
+            # The file doesn't parse; fall back to scanning for the next section
+            section_end = find_section_end_by_scan(content, section_start)
+        if section_end is None:
+            print("Could not determine the end of the document context section")
+            return False
         
         # The improved document context processing code
         improved_section = """# Process any document context if provided
@@ -70,15 +153,14 @@ def fix_direct_integration():
         
         if os.path.exists(config_path):
             try:
-                with open(config_path, 'r') as f:
-                    config = json.load(f)
+                config = _load_rag_config(config_path, os.path.getmtime(config_path))
                 context_limit = config.get("settings", {}).get("rag_context_limit", 50000)
                 use_model_for_rag = config.get("settings", {}).get("use_model_for_rag", True)
-            except:
+            except (OSError, ValueError):
                 pass
         
         # Format document content with clear structure and more content
-        document_text = "\\n\\n===== REFERENCE DOCUMENTS =====\\n"
+        parts = ["\\n\\n===== REFERENCE DOCUMENTS =====\\n"]
         total_chars = 0
         
         for i, doc in enumerate(document_context):
@@ -93,7 +175,7 @@ def fix_direct_integration():
                         doc_header += f" (Relevance: {relevance:.2f})"
                     doc_header += " -----\\n"
                     
-                    document_text += doc_header
+                    parts.append(doc_header)
                     
                     # Add as much content as possible within the limits
                     content_to_add = content
@@ -105,56 +187,65 @@ def fix_direct_integration():
                             content_to_add = content[:available_chars] + "... [content truncated to fit context window]"
                         else:
                             # Skip this document if we can't add enough content
-                            document_text += "Document content omitted to fit context window.\\n"
+                            parts.append("Document content omitted to fit context window.\\n")
                             continue
                     
-                    document_text += content_to_add + "\\n"
+                    parts.append(content_to_add)
+                    parts.append("\\n")
                     total_chars += len(doc_header) + len(content_to_add)
                     
                     # If we've exceeded our context limit, stop adding documents
                     if total_chars >= context_limit:
-                        document_text += "\\n[Additional documents omitted to fit context window]"
+                        parts.append("\\n[Additional documents omitted to fit context window]")
                         break
         
         # Add clear instructions for the LLM
-        document_text += "\\n\\n===== INSTRUCTIONS =====\\n"
-        document_text += "1. Use the information from the REFERENCE DOCUMENTS above to inform your analysis\\n"
-        document_text += "2. Cite specific information from documents when relevant to the analysis\\n"
-        document_text += "3. Acknowledge if the information in the documents contradicts or supports the user statement\\n"
-        document_text += "4. Do not fabricate information that is not in the documents or the user's statement\\n\\n"
+        parts.append("\\n\\n===== INSTRUCTIONS =====\\n"
+                     "1. Use the information from the REFERENCE DOCUMENTS above to inform your analysis\\n"
+                     "2. Cite specific information from documents when relevant to the analysis\\n"
+                     "3. Acknowledge if the information in the documents contradicts or supports the user statement\\n"
+                     "4. Do not fabricate information that is not in the documents or the user's statement\\n\\n")
+        document_text = "".join(parts)
         
         logger.info(f"Added {total_chars} characters of document context from {len(document_context)} documents")"""
         
         # Replace the section
         new_content = content[:section_start] + improved_section + content[section_end:]
         
-        # Write the updated content
-        with open(file_path, 'w') as f:
-            f.write(new_content)
+        # Add the config loader before the function holding the section
+        if "def _load_rag_config(" not in new_content:
+            function_start = new_content.rfind("\ndef ", 0, section_start) + 1
+            new_content = new_content[:function_start] + RAG_CONFIG_LOADER + new_content[function_start:]
         
-        # Validate the syntax of the Python file
+        # Validate the syntax before touching the file
         try:
-            import py_compile
-            py_compile.compile(file_path, doraise=True)
-            print(f"✅ Successfully fixed and validated {file_path}")
-            return True
-        except py_compile.PyCompileError as e:
-            print(f"Syntax error in fixed file: {e}")
-            # Restore from backup
-            with open(backup_path, 'r') as src, open(file_path, 'w') as dst:
-                dst.write(src.read())
-            print(f"Restored from backup due to syntax error")
+            ast.parse(new_content)
+        except SyntaxError as e:
+            print(f"Syntax error in fixed file, leaving {file_path} unchanged: {e}")
             return False
+        
+        if dry_run:
+            diff = difflib.unified_diff(content.splitlines(), new_content.splitlines(),
+                                        fromfile=file_path, tofile=file_path, lineterm="")
+            print(f"Dry run, not writing {file_path}:")
+            print("\n".join(diff))
+            return True
+        
+        # Write the updated content to a new file and swap it in, so a
+        # failure part way leaves the original untouched
+        tmp_path = f"{real_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(new_content)
+        os.replace(tmp_path, real_path)
+        
+        print(f"✅ Successfully fixed and validated {file_path}")
+        return True
     except Exception as e:
         print(f"Error fixing {file_path}: {e}")
-        # Try to restore from backup
-        try:
-            with open(backup_path, 'r') as src, open(file_path, 'w') as dst:
-                dst.write(src.read())
-            print(f"Restored from backup due to error")
-        except Exception as restore_error:
-            print(f"Error restoring from backup: {restore_error}")
         return False
 
 if __name__ == "__main__":
-    fix_direct_integration()
+    parser = argparse.ArgumentParser(description="Improve document context handling in direct_integration.py")
+    parser.add_argument("--dry-run", action="store_true", help="print the changes without writing any files")
+    args = parser.parse_args()
+    fix_direct_integration(dry_run=args.dry_run)
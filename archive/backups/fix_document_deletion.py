@@ -8,7 +8,26 @@ import sys
 import shutil
 import logging
 import json
+import difflib
+import argparse
 from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# ijson is optional; without it the document index is loaded whole
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+    IJSON_AVAILABLE = True
+except ImportError:
+    IJSON_AVAILABLE = False
+
+# orjson is optional; the stdlib json module is used without it
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,30 +38,115 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, script_dir)
 
 def backup_file(file_path):
-    """Create a backup of a file with .bak extension."""
+    """
+    Create a backup of a file with .deletion_fix_bak extension.
+    The backup is a hard link where possible, so the file must then be
+    replaced with a new file rather than rewritten in place.
+    Symlinks are followed, so the backup is taken next to the file they point to.
+    """
+    file_path = os.path.realpath(file_path)
     if os.path.exists(file_path):
         backup_path = f"{file_path}.deletion_fix_bak"
         logger.info(f"Creating backup of {file_path} to {backup_path}")
-        shutil.copy2(file_path, backup_path)
+        try:
+            os.remove(backup_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(file_path, backup_path)
+        except OSError:
+            # Cross-device or no hard link support
+            shutil.copy2(file_path, backup_path)
         return True
     return False
 
-def fix_document_deletion():
+def log_diff(before, after, path):
+    """Log a unified diff of the lines a dry run would have written to path."""
+    diff = difflib.unified_diff(before, after, fromfile=path, tofile=path, lineterm="")
+    logger.info(f"Dry run, not writing {path}:\n" + "\n".join(diff))
+
+def fix_document_deletion(dry_run=False):
     """Fix document deletion functionality in document_rag_routes.py."""
     logger.info("Fixing document deletion functionality...")
     
     # Copy the fixed document_rag_routes.py
     src_file = os.path.join(script_dir, "web_interface", "fixed_document_rag_routes.py")
     dst_file = os.path.join(script_dir, "web_interface", "document_rag_routes.py")
-    if os.path.exists(src_file):
+    if os.path.exists(src_file) and dry_run:
+        with open(src_file, 'r') as f:
+            new_lines = f.read().splitlines()
+        old_lines = []
+        if os.path.exists(dst_file):
+            with open(dst_file, 'r') as f:
+                old_lines = f.read().splitlines()
+        log_diff(old_lines, new_lines, dst_file)
+    elif os.path.exists(src_file):
         backup_file(dst_file)
-        shutil.copy2(src_file, dst_file)
+        # Replace the file a symlink points to rather than the link itself
+        real_dst_file = os.path.realpath(dst_file)
+        tmp_file = f"{real_dst_file}.tmp"
+        shutil.copy2(src_file, tmp_file)
+        os.replace(tmp_file, real_dst_file)
         logger.info(f"Applied document_rag_routes.py fixes")
     else:
         logger.error(f"Fixed document routes file not found: {src_file}")
 
-def cleanup_document_index():
-    """Clean up the document index by removing entries with invalid file paths."""
+def write_index(index_file, index_data):
+    """Write the document index atomically through a temporary file, following symlinks."""
+    index_file = os.path.realpath(index_file)
+    if ORJSON_AVAILABLE:
+        content = orjson.dumps(index_data, option=orjson.OPT_INDENT_2)
+    else:
+        content = json.dumps(index_data, indent=2).encode('utf-8')
+    
+    tmp_file = f"{index_file}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, index_file)
+
+def _is_valid_document(doc):
+    """Whether a document entry points at an existing file."""
+    # Skip documents with None or invalid file paths
+    return bool((file_path := doc.get("file_path")) and os.path.exists(file_path))
+
+def _stream_valid_documents(index_file):
+    """
+    Parse the document index with ijson in one pass, dropping invalid documents as they are read.
+    Returns (index_data, original_count).
+    """
+    original_count = 0
+    valid_documents = []
+    builder = ObjectBuilder()
+    doc_builder = None
+    with open(index_file, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            # Build each document on its own and keep it only if it is valid
+            if prefix == "documents.item" and doc_builder is None and not event.startswith("end_"):
+                original_count += 1
+                if event == "start_map":
+                    doc_builder = ObjectBuilder()
+            if doc_builder is not None:
+                doc_builder.event(event, value)
+                if prefix == "documents.item" and event == "end_map":
+                    if _is_valid_document(doc_builder.value):
+                        valid_documents.append(doc_builder.value)
+                    doc_builder = None
+                continue
+            
+            # Everything outside the documents list goes into the other top-level keys
+            if prefix == "documents" or prefix.startswith("documents.") or (prefix == "" and event == "map_key" and value == "documents"):
+                continue
+            builder.event(event, value)
+    
+    return {"documents": valid_documents, **builder.value}, original_count
+
+def cleanup_document_index(dry_run=False):
+    """
+    Clean up the document index by removing entries with invalid file paths.
+    With dry_run, the index is left alone and the removals are logged as a diff.
+    """
     logger.info("Cleaning up document index...")
     
     # Get document index file path
@@ -51,35 +155,37 @@ def cleanup_document_index():
         logger.error(f"Document index file not found: {index_file}")
         return False
     
-    # Create backup of index file
-    backup_file(index_file)
-    
     # Load document index
     try:
-        with open(index_file, 'r') as f:
-            index_data = json.load(f)
-        
-        documents = index_data.get("documents", [])
-        original_count = len(documents)
-        valid_documents = []
-        
-        # Check each document
-        for doc in documents:
-            file_path = doc.get("file_path")
-            # Skip documents with None or invalid file paths
-            if file_path and os.path.exists(file_path):
-                valid_documents.append(doc)
-            else:
-                logger.info(f"Removing invalid document entry: {doc.get('id')} - {doc.get('filename', 'unknown')}")
+        # A dry run loads the whole index so the removed entries can be diffed
+        if IJSON_AVAILABLE and not dry_run:
+            index_data, original_count = _stream_valid_documents(index_file)
+        else:
+            with open(index_file, 'r') as f:
+                index_data = json.load(f)
+            
+            documents = index_data.get("documents", [])
+            original_count = len(documents)
+            if dry_run:
+                original_lines = json.dumps(index_data, indent=2).splitlines()
+            
+            # Update index with valid documents only
+            index_data["documents"] = [doc for doc in documents if _is_valid_document(doc)]
+        removed = original_count - len(index_data["documents"])
+        if not removed:
+            logger.info("Document index has no invalid entries")
+            return True
+        logger.info(f"Removing {removed} invalid document entries")
         
-        # Update index with valid documents only
-        index_data["documents"] = valid_documents
+        if dry_run:
+            log_diff(original_lines, json.dumps(index_data, indent=2).splitlines(), index_file)
+            return True
         
-        # Save updated index
-        with open(index_file, 'w') as f:
-            json.dump(index_data, f, indent=2)
+        # Create backup of index file and save updated index
+        backup_file(index_file)
+        write_index(index_file, index_data)
         
-        logger.info(f"Cleaned up document index - removed {original_count - len(valid_documents)} invalid entries")
+        logger.info(f"Cleaned up document index - removed {removed} invalid entries")
         return True
     
     except Exception as e:
@@ -108,26 +214,34 @@ def check_document_directories():
         
         documents = index_data.get("documents", [])
         
-        # Check each document
+        # Group the documents by directory so each directory is listed once
+        file_paths_by_dir = defaultdict(list)
         for doc in documents:
-            doc_id = doc.get("id")
             file_path = doc.get("file_path")
-            
             if not file_path:
-                logger.warning(f"Document {doc_id} has no file path")
+                logger.warning(f"Document {doc.get('id')} has no file path")
                 continue
-            
+            file_paths_by_dir[os.path.dirname(file_path)].append(file_path)
+        
+        for doc_dir, file_paths in file_paths_by_dir.items():
             # Check if document directory exists
-            doc_dir = os.path.dirname(file_path)
-            if not os.path.exists(doc_dir):
+            try:
+                with os.scandir(doc_dir or ".") as entries:
+                    names = {entry.name for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
                 logger.warning(f"Document directory does not exist: {doc_dir}")
                 # Optionally create the directory
                 # os.makedirs(doc_dir, exist_ok=True)
                 # logger.info(f"Created document directory: {doc_dir}")
+                names = set()
+            except PermissionError:
+                logger.warning(f"Document directory is not readable, skipping its files: {doc_dir}")
+                continue
             
-            # Check if document file exists
-            if not os.path.exists(file_path):
-                logger.warning(f"Document file does not exist: {file_path}")
+            # Check if document files exist
+            for file_path in file_paths:
+                if os.path.basename(file_path) not in names:
+                    logger.warning(f"Document file does not exist: {file_path}")
         
         logger.info(f"Checked {len(documents)} document entries")
         return True
@@ -136,20 +250,32 @@ def check_document_directories():
         logger.error(f"Error checking document directories: {e}")
         return False
 
-def main():
-    """Apply all fixes."""
+def main(dry_run=False):
+    """Apply all fixes. With dry_run, only log what would change."""
     logger.info("Starting to fix document deletion issues...")
     
-    # Fix document deletion functionality
-    fix_document_deletion()
+    # The three steps touch different files and mostly wait on the filesystem,
+    # so run them side by side. The index is replaced atomically, so the
+    # directory check reads either the old or the cleaned index.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            # Fix document deletion functionality
+            executor.submit(fix_document_deletion, dry_run),
+            # Clean up document index
+            executor.submit(cleanup_document_index, dry_run),
+            # Check document directories
+            executor.submit(check_document_directories),
+        ]
+        for future in futures:
+            future.result()
     
-    # Clean up document index
-    cleanup_document_index()
-    
-    # Check document directories
-    check_document_directories()
-    
-    logger.info("Fixes applied successfully. Restart the application to see the changes.")
+    if dry_run:
+        logger.info("Dry run complete, no files were changed.")
+    else:
+        logger.info("Fixes applied successfully. Restart the application to see the changes.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fix document deletion issues")
+    parser.add_argument("--dry-run", action="store_true", help="log the changes without writing any files")
+    args = parser.parse_args()
+    main(dry_run=args.dry_run)
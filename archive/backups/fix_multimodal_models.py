@@ -12,30 +12,260 @@ import os
 import sys
 import json
 import shutil
+import re
+import mmap
+import time
+import hashlib
+import functools
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# libcst is optional; without it the Python files are patched by text search
+try:
+    import libcst as cst
+    import libcst.matchers as m
+    LIBCST_AVAILABLE = True
+except ImportError:
+    LIBCST_AVAILABLE = False
+
+# jinja2 is optional; without it the partials are inserted as plain text
+try:
+    import jinja2
+    JINJA2_AVAILABLE = True
+except ImportError:
+    JINJA2_AVAILABLE = False
+
+# orjson is optional; the stdlib json module is used without it
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+OLLAMA_URL = "http://localhost:11434"
+
+# The HTML and JavaScript fragments inserted into the templates
+PARTIALS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mm_partials")
+
+# Ollama's model list is cached here for a short while, so repeated runs don't re-query it
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai-socratic-clarifier")
+OLLAMA_TAGS_CACHE = os.path.join(CACHE_DIR, "ollama_tags.json")
+OLLAMA_TAGS_TTL = 60
+# Files this script has already patched, so re-runs can skip them without reading them
+PATCHED_CACHE = os.path.join(CACHE_DIR, "mm_models_patched.json")
+
+# Ollama model names that indicate multimodal capabilities
+MULTIMODAL_MODEL_RE = re.compile(r"llava|vision|multi|bakllava|gemma3|phi4", re.IGNORECASE)
+
+# The analysis mode toggle up to the end of its enclosing div
+MODE_TOGGLE_RE = re.compile(rb'class="mode-toggle".*?</div>.*?</div>', re.DOTALL)
+# The FormData built by processFile, up to where it is sent
+PROCESS_FILE_FORM_DATA_RE = re.compile(rb"function processFile.*?(?P<form_data>const formData = new FormData\(\).*?)// Send to server", re.DOTALL)
+MODE_APPEND_RE = re.compile(rb"formData\.append\('mode'[^\n]*\n")
+# The mode line and the multimodal process_file call in process_document
+PROCESS_DOCUMENT_RE = re.compile(
+    r"def process_document\(\).*?^(?P<mode>(?P<indent>[ \t]*)mode = request\.form\.get\([^\n]*\n).*?"
+    r"if mode == 'multimodal':.*?(?P<call>result = process_file[^)]*\))",
+    re.DOTALL | re.MULTILINE,
+)
+MULTIMODAL_MODEL_ASSIGNMENT_RE = re.compile(r"^(?P<indent>[ \t]*)multimodal_model = (?P<value>config\.get[^\n]*)$", re.MULTILINE)
+
+# Shared session so the Ollama requests reuse one connection
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+# Messages logged by an update step running on a worker thread, printed once the step is done
+_OUTPUT = threading.local()
+
+def log(message):
+    """Print a progress message, or hold it back if the current thread's step is being collected."""
+    lines = getattr(_OUTPUT, "lines", None)
+    if lines is None:
+        print(message)
+    else:
+        lines.append(message)
+
+def _run_step(step):
+    """Run an update step, returning its result and the messages it logged."""
+    _OUTPUT.lines = []
+    try:
+        return step(), _OUTPUT.lines
+    finally:
+        _OUTPUT.lines = None
+
+@functools.lru_cache(maxsize=32)
+def _read_cached(path, mtime):
+    with open(path, 'r') as f:
+        return f.read()
+
+def read_text(path):
+    """Read a text file, rereading it only when its mtime changes."""
+    return _read_cached(path, os.path.getmtime(path))
+
+def load_json(path):
+    """Parse a JSON file from its cached text, so callers are free to modify the result."""
+    return json.loads(read_text(path))
+
+def atomic_write(path, content):
+    """
+    Replace a text (or bytes) file through a temporary file in the same directory.
+    A crash never leaves a partly written file, and hard-linked backups keep the old contents.
+    Symlinks are followed, so the file they point to is replaced rather than the link.
+    """
+    path = os.path.realpath(path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def save_json(path, data):
+    """Write a JSON file atomically, indented by 2, with orjson when available."""
+    if ORJSON_AVAILABLE:
+        atomic_write(path, orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        atomic_write(path, json.dumps(data, indent=2))
+
+@functools.lru_cache(maxsize=1)
+def _partials_env():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(PARTIALS_DIR),
+        auto_reload=False,
+        keep_trailing_newline=True,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(CACHE_DIR),
+    )
+
+@functools.lru_cache(maxsize=None)
+def load_partial(name):
+    """Render one of the fragments in mm_partials, once per process."""
+    if JINJA2_AVAILABLE:
+        return _partials_env().get_template(name).render()
+    with open(os.path.join(PARTIALS_DIR, name), 'r') as f:
+        return f.read()
+
+def splice(content, edits):
+    """
+    Apply (offset, text) insertions to content in a single join.
+    Offsets refer to the original content; insertions at the same offset keep their order.
+    """
+    edits = sorted(edits, key=lambda edit: edit[0])
+    parts = []
+    prev = 0
+    for offset, text in edits:
+        parts.append(content[prev:offset])
+        parts.append(text)
+        prev = offset
+    parts.append(content[prev:])
+    return content[:0].join(parts)
+
+_patched_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _load_patched_cache():
+    try:
+        with open(PATCHED_CACHE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _patch_key(path):
+    """Identify a file version by its mtime and a hash of its first 4KB."""
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+    return f"{mtime}:{hashlib.sha1(head).hexdigest()}"
+
+def is_patched(path):
+    """Whether path is unchanged since this script last patched it."""
+    key = _load_patched_cache().get(os.path.abspath(path))
+    return key is not None and key == _patch_key(path)
+
+def mark_patched(path):
+    """Record path as patched in its current version."""
+    with _patched_lock:
+        cache = _load_patched_cache()
+        cache[os.path.abspath(path)] = _patch_key(path)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            atomic_write(PATCHED_CACHE, json.dumps(cache, indent=2))
+        except OSError as e:
+            log(f"Warning: could not record {path} as patched: {e}")
 
 def backup_file(file_path):
-    """Create a backup of a file."""
+    """
+    Create a backup of a file.
+    The backup is a hard link where possible, so the file must then be
+    replaced (see atomic_write) rather than rewritten in place.
+    Symlinks are followed, so the backup is taken next to the file they point to.
+    """
+    file_path = os.path.realpath(file_path)
     backup_path = f"{file_path}.mm_models_bak"
     if os.path.exists(file_path):
-        print(f"Creating backup of {file_path} to {backup_path}")
-        shutil.copy2(file_path, backup_path)
+        log(f"Creating backup of {file_path} to {backup_path}")
+        try:
+            os.remove(backup_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(file_path, backup_path)
+        except OSError:
+            # Cross-device or no hard link support
+            shutil.copy2(file_path, backup_path)
     return backup_path
 
+def _get_ollama_models(base_url=OLLAMA_URL, ttl=OLLAMA_TAGS_TTL):
+    """
+    Get the models listed by Ollama's /api/tags, cached on disk for ttl seconds.
+    Returns None if Ollama can't be reached.
+    """
+    try:
+        if time.time() - os.path.getmtime(OLLAMA_TAGS_CACHE) < ttl:
+            with open(OLLAMA_TAGS_CACHE, 'r') as f:
+                cached = json.load(f)
+            if cached.get("base_url") == base_url:
+                return cached["models"]
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    try:
+        response = _SESSION.get(f"{base_url}/api/tags", timeout=2.0)
+        if response.status_code != 200:
+            return None
+        models = response.json().get("models", [])
+    except (requests.RequestException, ValueError):
+        return None
+    
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        atomic_write(OLLAMA_TAGS_CACHE, json.dumps({"base_url": base_url, "models": models}))
+    except OSError as e:
+        log(f"Warning: could not cache Ollama models: {e}")
+    return models
+
 def update_config_multimodal_models():
     """Update config.json to include all multimodal models."""
     config_path = os.path.join('config.json')
     
     if not os.path.exists(config_path):
-        print(f"Error: {config_path} not found")
+        log(f"Error: {config_path} not found")
         return False
     
     backup_file(config_path)
     
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = load_json(config_path)
         
         # Add multimodal models section to config
         if "integrations" not in config:
@@ -46,46 +276,37 @@ def update_config_multimodal_models():
         
         # Try to detect available multimodal models from Ollama
         multimodal_models = []
-        try:
-            response = requests.get("http://localhost:11434/api/tags")
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                
-                # Look for models with multimodal capabilities
-                for model in models:
-                    name = model.get("name", "")
-                    if any(mm in name.lower() for mm in ["llava", "vision", "multi", "bakllava", "gemma3", "phi4"]):
-                        multimodal_models.append(name)
-                
-                if not multimodal_models:
-                    multimodal_models = ["llava:latest", "gemma3:latest"]
-            else:
-                multimodal_models = ["llava:latest", "gemma3:latest"]
-        except:
+        default_mm_model = None
+        models = _get_ollama_models()
+        if models is not None:
+            # Look for models with multimodal capabilities, keeping the first
+            # Gemma3 model as the default as we go
+            for name in dict.fromkeys(model.get("name", "") for model in models):
+                if MULTIMODAL_MODEL_RE.search(name):
+                    multimodal_models.append(name)
+                    if default_mm_model is None and "gemma3" in name.lower():
+                        default_mm_model = name
+        
+        if not multimodal_models:
             # Fallback options
             multimodal_models = ["llava:latest", "gemma3:latest"]
+            default_mm_model = "gemma3:latest"
         
         # Add all available multimodal models to config
         config["integrations"]["ollama"]["multimodal_models"] = multimodal_models
         
         # Set default model (prefer Gemma3 if available)
-        default_mm_model = "llava:latest"
-        for model in multimodal_models:
-            if "gemma3" in model.lower():
-                default_mm_model = model
-                break
-            
+        default_mm_model = default_mm_model or "llava:latest"
         config["integrations"]["ollama"]["multimodal_model"] = default_mm_model
         
         # Write updated config
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=4)
+        save_json(config_path, config)
         
-        print(f"✅ Updated config.json with multimodal models: {', '.join(multimodal_models)}")
-        print(f"   Default multimodal model set to: {default_mm_model}")
+        log(f"✅ Updated config.json with multimodal models: {', '.join(multimodal_models)}")
+        log(f"   Default multimodal model set to: {default_mm_model}")
         return True
     except Exception as e:
-        print(f"Error updating config: {e}")
+        log(f"Error updating config: {e}")
         return False
 
 def update_multimodal_template():
@@ -93,349 +314,353 @@ def update_multimodal_template():
     template_path = os.path.join('web_interface', 'templates', 'multimodal.html')
     
     if not os.path.exists(template_path):
-        print(f"Error: {template_path} not found")
+        log(f"Error: {template_path} not found")
         return False
     
+    # Skip files this script already patched, before backing them up
+    if is_patched(template_path):
+        log("Model selection already exists in template")
+        return True
+    
     backup_file(template_path)
     
     try:
-        with open(template_path, 'r') as f:
-            content = f.read()
-        
-        # Check if model selection already exists
-        if 'id="multimodal-model-select"' in content:
-            print("Model selection already exists in template")
-            return True
-        
-        # Add model selection dropdown
-        if 'class="mode-toggle"' in content:
-            # Find the analysis mode toggle section
-            mode_toggle = content.find('class="mode-toggle"')
-            end_of_section = content.find("</div>", mode_toggle)
-            end_of_section = content.find("</div>", end_of_section + 1)
-            
-            if mode_toggle > 0 and end_of_section > 0:
-                # Add model selection dropdown
-                model_selection = """
-                <div class="mb-3 mt-3">
-                    <label for="multimodal-model-select" class="form-label">Multimodal Model:</label>
-                    <select id="multimodal-model-select" class="form-select">
-                        <!-- Options will be populated by JavaScript -->
-                    </select>
-                </div>
-"""
-                # Insert after mode toggle
-                new_content = content[:end_of_section + 6] + model_selection + content[end_of_section + 6:]
-                
-                # Add JavaScript to populate model selection
-                script_section = """
-<script>
-    // Populate multimodal model selection dropdown
-    function populateMultimodalModels() {
-        fetch('/api/settings')
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    const modelSelect = document.getElementById('multimodal-model-select');
-                    if (modelSelect) {
-                        // Clear existing options
-                        modelSelect.innerHTML = '';
-                        
-                        // Get multimodal models
-                        const multimodalModels = data.settings?.integrations?.ollama?.multimodal_models || [];
-                        const defaultModel = data.settings?.integrations?.ollama?.multimodal_model || 'llava:latest';
-                        
-                        // Add options
-                        multimodalModels.forEach(model => {
-                            const option = document.createElement('option');
-                            option.value = model;
-                            option.text = model;
-                            option.selected = (model === defaultModel);
-                            modelSelect.appendChild(option);
-                        });
-                        
-                        // Add llava:latest as fallback if not in the list
-                        if (multimodalModels.length === 0) {
-                            const option = document.createElement('option');
-                            option.value = 'llava:latest';
-                            option.text = 'llava:latest';
-                            option.selected = true;
-                            modelSelect.appendChild(option);
-                            
-                            // Also add gemma3:latest
-                            const gemmaOption = document.createElement('option');
-                            gemmaOption.value = 'gemma3:latest';
-                            gemmaOption.text = 'gemma3:latest';
-                            modelSelect.appendChild(gemmaOption);
-                        }
-                    }
-                }
-            })
-            .catch(error => {
-                console.error('Error loading multimodal models:', error);
-                // Add fallback option
-                const modelSelect = document.getElementById('multimodal-model-select');
-                if (modelSelect) {
-                    modelSelect.innerHTML = '';
-                    
-                    const defaultOption = document.createElement('option');
-                    defaultOption.value = 'llava:latest';
-                    defaultOption.text = 'llava:latest';
-                    defaultOption.selected = true;
-                    modelSelect.appendChild(defaultOption);
-                    
-                    const gemmaOption = document.createElement('option');
-                    gemmaOption.value = 'gemma3:latest';
-                    gemmaOption.text = 'gemma3:latest';
-                    modelSelect.appendChild(gemmaOption);
-                }
-            });
-    }
-    
-    // Call on page load
-    document.addEventListener('DOMContentLoaded', function() {
-        populateMultimodalModels();
-    });
-</script>
-"""
-                
-                # Add script to the end of the file (before closing body tag)
-                body_end = new_content.rfind("</body>")
-                if body_end > 0:
-                    new_content = new_content[:body_end] + script_section + new_content[body_end:]
-                
-                # Modify the FormData in the processFile function to include the selected model
-                process_function = new_content.find("function processFile")
-                if process_function > 0:
-                    form_data_section = new_content.find("const formData = new FormData()", process_function)
-                    form_data_end = new_content.find("// Send to server", form_data_section)
-                    
-                    if form_data_section > 0 and form_data_end > 0:
-                        # Get the current formData section
-                        current_form_data = new_content[form_data_section:form_data_end]
-                        
-                        # Add model selection to formData
-                        updated_form_data = current_form_data
-                        if "formData.append('model'" not in updated_form_data:
-                            # Add after mode
-                            mode_append = updated_form_data.find("formData.append('mode'")
-                            if mode_append > 0:
-                                end_of_line = updated_form_data.find("\n", mode_append)
-                                if end_of_line > 0:
-                                    updated_form_data = (
-                                        updated_form_data[:end_of_line + 1] + 
-                                        "                const selectedModel = document.getElementById('multimodal-model-select').value;\n" +
-                                        "                formData.append('model', selectedModel);\n" + 
-                                        updated_form_data[end_of_line + 1:]
-                                    )
-                        
-                        # Replace the form data section
-                        new_content = new_content[:form_data_section] + updated_form_data + new_content[form_data_end:]
-                
-                # Write updated template
-                with open(template_path, 'w') as f:
-                    f.write(new_content)
-                
-                print("✅ Added multimodal model selection to template")
+        # Scan the template through mmap, so it is only read into memory when it needs patching
+        with open(template_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            # Check if model selection already exists
+            if content.find(b'id="multimodal-model-select"') != -1:
+                mark_patched(template_path)
+                log("Model selection already exists in template")
                 return True
-            else:
-                print("Could not find mode toggle section in template")
+            
+            # Find the analysis mode toggle section
+            mode_toggle = MODE_TOGGLE_RE.search(content)
+            if not mode_toggle:
+                log("Could not find mode toggle section in template")
                 return False
-        else:
-            print("Could not find mode toggle section in template")
-            return False
             
+            # Collect the insertions against the original template and splice them in once
+            # Add model selection dropdown after mode toggle
+            edits = [(mode_toggle.end(), load_partial("multimodal_model_select.html").encode('utf-8'))]
+            
+            # Add JavaScript to populate model selection at the end of the file (before closing body tag)
+            body_end = content.rfind(b"</body>")
+            if body_end > 0:
+                edits.append((body_end, load_partial("multimodal_models_script.html").encode('utf-8')))
+            
+            # Modify the FormData in the processFile function to include the selected model
+            form_data = PROCESS_FILE_FORM_DATA_RE.search(content)
+            if form_data and b"formData.append('model'" not in form_data.group("form_data"):
+                # Add after mode
+                mode_append = MODE_APPEND_RE.search(content, form_data.start("form_data"), form_data.end("form_data"))
+                if mode_append:
+                    edits.append((mode_append.end(),
+                                  b"                const selectedModel = document.getElementById('multimodal-model-select').value;\n"
+                                  b"                formData.append('model', selectedModel);\n"))
+            
+            new_content = splice(content, edits)
+        
+        # Write updated template
+        atomic_write(template_path, new_content)
+        mark_patched(template_path)
+        
+        log("✅ Added multimodal model selection to template")
+        return True
+        
     except Exception as e:
-        print(f"Error updating multimodal template: {e}")
+        log(f"Error updating multimodal template: {e}")
         return False
 
+if LIBCST_AVAILABLE:
+    _EMPTY_MODULE = cst.Module(body=[])
+    MODEL_ARG = cst.parse_expression("f(model=model)").args[0]
+    MODEL_STATEMENT = cst.parse_statement("model = request.form.get('model')\n").with_changes(
+        leading_lines=[cst.EmptyLine(), cst.EmptyLine(comment=cst.Comment("# Get multimodal model if specified"))]
+    )
+    
+    def _code(node):
+        """Source code of a single node."""
+        return _EMPTY_MODULE.code_for_node(node)
+    
+    def _with_model_param(function, annotation):
+        """Append a model parameter to a function definition unless it already has one."""
+        params = function.params
+        if any(param.name.value == "model" for param in params.params):
+            return function
+        param = cst.parse_statement(f"def f(model: {annotation} = None): pass\n").params.params[0]
+        return function.with_changes(params=params.with_changes(params=(*params.params, param)))
+    
+    def _with_model_arg(call):
+        """Append model=model to a call unless it already passes model."""
+        if any(arg.keyword and arg.keyword.value == "model" for arg in call.args):
+            return call
+        return call.with_changes(args=(*call.args, MODEL_ARG))
+    
+    class RoutesModelTransformer(cst.CSTTransformer):
+        """Read the model from the request form in process_document and pass it to process_file in the multimodal branch."""
+        
+        def __init__(self):
+            super().__init__()
+            self.found_function = False
+            self.in_function = False
+            self.has_model = False
+            self.multimodal_depth = 0
+            self.found_call = False
+        
+        def visit_FunctionDef(self, node):
+            if node.name.value == "process_document":
+                self.found_function = self.in_function = True
+                self.has_model = bool(m.findall(node, m.Assign(targets=[m.AssignTarget(target=m.Name("model"))])))
+        
+        def leave_FunctionDef(self, original_node, updated_node):
+            if original_node.name.value == "process_document":
+                self.in_function = False
+            return updated_node
+        
+        def visit_If_body(self, node):
+            if self.in_function and _code(node.test) == "mode == 'multimodal'":
+                self.multimodal_depth += 1
+        
+        def leave_If_body(self, node):
+            if self.in_function and _code(node.test) == "mode == 'multimodal'":
+                self.multimodal_depth -= 1
+        
+        def leave_Call(self, original_node, updated_node):
+            if self.multimodal_depth and _code(updated_node.func) == "process_file":
+                self.found_call = True
+                return _with_model_arg(updated_node)
+            return updated_node
+        
+        def leave_SimpleStatementLine(self, original_node, updated_node):
+            # Add the model right after the processing mode is read
+            if self.in_function and not self.has_model and _code(updated_node.body[0]).startswith("mode = request.form.get("):
+                self.has_model = True
+                return cst.FlattenSentinel([updated_node, MODEL_STATEMENT])
+            return updated_node
+    
+    class IntegrationModelTransformer(cst.CSTTransformer):
+        """Add a model parameter to process_file and analyze_image_with_multimodal and pass it through."""
+        
+        def __init__(self):
+            super().__init__()
+            self.functions = []
+            self.found_process_file = False
+            self.found_analyze = False
+            self.found_assignment = False
+        
+        def visit_FunctionDef(self, node):
+            self.functions.append(node.name.value)
+        
+        def leave_Call(self, original_node, updated_node):
+            if self.functions[-1:] == ["process_file"] and _code(updated_node.func) == "analyze_image_with_multimodal":
+                return _with_model_arg(updated_node)
+            return updated_node
+        
+        def leave_FunctionDef(self, original_node, updated_node):
+            name = self.functions.pop()
+            if name == "process_file":
+                self.found_process_file = True
+                return _with_model_param(updated_node, "str")
+            if name != "analyze_image_with_multimodal":
+                return updated_node
+            
+            self.found_analyze = True
+            body = []
+            for statement in updated_node.body.body:
+                if m.matches(statement, m.If(test=m.Name("model"))):
+                    # Already patched
+                    self.found_assignment = True
+                elif not self.found_assignment and m.matches(statement, m.SimpleStatementLine(
+                        body=[m.Assign(targets=[m.AssignTarget(target=m.Name("multimodal_model"))])])):
+                    # Use provided model if specified, otherwise get from config
+                    self.found_assignment = True
+                    statement = cst.parse_statement(
+                        "if model:\n"
+                        "    multimodal_model = model\n"
+                        "else:\n"
+                        f"    multimodal_model = {_code(statement.body[0].value)}\n"
+                    ).with_changes(leading_lines=[
+                        *statement.leading_lines,
+                        cst.EmptyLine(comment=cst.Comment("# Use provided model if specified, otherwise get from config")),
+                    ])
+                body.append(statement)
+            updated_node = updated_node.with_changes(body=updated_node.body.with_changes(body=body))
+            return _with_model_param(updated_node, "Optional[str]")
+
+def _patch_routes_by_cst(content):
+    """Patch routes_multimodal.py with libcst. Returns None if a patch point is missing."""
+    transformer = RoutesModelTransformer()
+    new_content = cst.parse_module(content).visit(transformer).code
+    if not transformer.found_function:
+        log("Could not find process_document function")
+        return None
+    if not transformer.has_model:
+        log("Could not find the processing mode in process_document")
+        return None
+    if not transformer.found_call:
+        log("Could not find process_file call in multimodal section")
+        return None
+    return new_content
+
+def _patch_routes_by_text(content):
+    """Patch routes_multimodal.py by text search. Returns None if a patch point is missing."""
+    # Check if model selection already supported
+    if "model = request.form.get('model'" in content:
+        return content
+    
+    match = PROCESS_DOCUMENT_RE.search(content)
+    if not match:
+        log("Could not find the multimodal process_file call in process_document")
+        return None
+    
+    # Get the model after the mode line and pass it to process_file
+    indent = match.group("indent")
+    model_code = f"{indent}\n{indent}# Get multimodal model if specified\n{indent}model = request.form.get('model')\n"
+    current_call = match.group("call")
+    updated_call = current_call if "model" in current_call else current_call.replace(")", ", model=model)")
+    return (
+        content[:match.end("mode")] + model_code +
+        content[match.end("mode"):match.start("call")] + updated_call +
+        content[match.end("call"):]
+    )
+
 def update_routes_multimodal():
     """Update routes_multimodal.py to support model selection."""
     routes_path = os.path.join('web_interface', 'routes_multimodal.py')
     
     if not os.path.exists(routes_path):
-        print(f"Error: {routes_path} not found")
+        log(f"Error: {routes_path} not found")
         return False
     
+    # Skip files this script already patched, before backing them up
+    if is_patched(routes_path):
+        log("Model selection already supported in routes")
+        return True
+    
     backup_file(routes_path)
     
     try:
-        with open(routes_path, 'r') as f:
-            content = f.read()
-        
-        # Check if model selection already supported
-        if "model = request.form.get('model'" in content:
-            print("Model selection already supported in routes")
-            return True
+        content = read_text(routes_path)
         
-        # Update the process_document function
-        process_function = content.find("def process_document()")
-        if process_function > 0:
-            # Find where to add the model parameter
-            file_path_line = content.find("file_path = os.path.join", process_function)
-            
-            if file_path_line > 0:
-                # Add before this line
-                model_code = "    # Get multimodal model if specified\n    model = request.form.get('model')\n\n"
-                new_content = content[:file_path_line] + model_code + content[file_path_line:]
-                
-                # Find multimodal analysis section
-                multimodal_section = new_content.find("if mode == 'multimodal':", process_function)
-                if multimodal_section > 0:
-                    # Find the process_file call
-                    process_call = new_content.find("result = process_file", multimodal_section)
-                    
-                    if process_call > 0:
-                        # Find the end of the line
-                        end_of_line = new_content.find(")", process_call)
-                        
-                        if end_of_line > 0:
-                            # Add model parameter to process_file call
-                            current_call = new_content[process_call:end_of_line + 1]
-                            
-                            # Check if it already includes model
-                            if "model" not in current_call:
-                                # Add model parameter
-                                updated_call = current_call.replace(")", ", model=model)")
-                                
-                                # Replace the call
-                                new_content = new_content[:process_call] + updated_call + new_content[end_of_line + 1:]
-                                
-                                # Write updated content
-                                with open(routes_path, 'w') as f:
-                                    f.write(new_content)
-                                
-                                print("✅ Updated routes_multimodal.py to support model selection")
-                                return True
-                            else:
-                                print("Model parameter already included in process_file call")
-                                return True
-                        else:
-                            print("Could not find end of process_file call")
-                            return False
-                    else:
-                        print("Could not find process_file call in multimodal section")
-                        return False
-                else:
-                    print("Could not find multimodal section")
-                    return False
-            else:
-                print("Could not find file_path line in process_document function")
-                return False
+        if LIBCST_AVAILABLE:
+            new_content = _patch_routes_by_cst(content)
         else:
-            print("Could not find process_document function")
+            new_content = _patch_routes_by_text(content)
+        if new_content is None:
             return False
-            
+        
+        if new_content == content:
+            mark_patched(routes_path)
+            log("Model selection already supported in routes")
+            return True
+        
+        # Write updated content
+        atomic_write(routes_path, new_content)
+        mark_patched(routes_path)
+        
+        log("✅ Updated routes_multimodal.py to support model selection")
+        return True
+    
     except Exception as e:
-        print(f"Error updating routes_multimodal.py: {e}")
+        log(f"Error updating routes_multimodal.py: {e}")
         return False
 
+def _patch_integration_by_cst(content):
+    """Patch multimodal_integration.py with libcst. Returns None if a patch point is missing."""
+    transformer = IntegrationModelTransformer()
+    new_content = cst.parse_module(content).visit(transformer).code
+    if not transformer.found_process_file:
+        log("Could not find process_file function")
+        return None
+    if not transformer.found_analyze:
+        log("Could not find analyze_image_with_multimodal function")
+        return None
+    if not transformer.found_assignment:
+        log("Could not find multimodal_model assignment")
+        return None
+    return new_content
+
+def _patch_integration_by_text(content):
+    """Patch multimodal_integration.py by text search. Returns None if a patch point is missing."""
+    process_signature = "def process_file(file_path: str, use_multimodal: bool = True)"
+    analyze_signature = "def analyze_image_with_multimodal(image_path: str, prompt: Optional[str] = None)"
+    
+    # Check if model parameter already supported
+    if "def process_file(file_path: str, use_multimodal: bool = True, model: str = None)" in content:
+        return content
+    
+    if process_signature not in content:
+        log("Could not find process_file function")
+        return None
+    if "return analyze_image_with_multimodal(file_path)" not in content:
+        log("Could not find analyze_image_with_multimodal call")
+        return None
+    if analyze_signature not in content:
+        log("Could not find analyze_image_with_multimodal function")
+        return None
+    
+    # Update the signatures and pass the model on, including the call in the PDF section
+    new_content = content.replace(process_signature, "def process_file(file_path: str, use_multimodal: bool = True, model: str = None)", 1)
+    new_content = new_content.replace("return analyze_image_with_multimodal(file_path)", "return analyze_image_with_multimodal(file_path, model=model)", 1)
+    new_content = new_content.replace("result = analyze_image_with_multimodal(temp_path)", "result = analyze_image_with_multimodal(temp_path, model=model)", 1)
+    new_content = new_content.replace(analyze_signature, "def analyze_image_with_multimodal(image_path: str, prompt: Optional[str] = None, model: Optional[str] = None)", 1)
+    
+    # Find multimodal_model assignment
+    assignment = MULTIMODAL_MODEL_ASSIGNMENT_RE.search(new_content, new_content.find("def analyze_image_with_multimodal("))
+    if not assignment:
+        log("Could not find multimodal_model assignment")
+        return None
+    
+    # Update to use passed model if provided
+    indent = assignment.group("indent")
+    updated_assignment = (
+        f"{indent}# Use provided model if specified, otherwise get from config\n"
+        f"{indent}if model:\n"
+        f"{indent}    multimodal_model = model\n"
+        f"{indent}else:\n"
+        f"{indent}    multimodal_model = {assignment.group('value')}"
+    )
+    return new_content[:assignment.start()] + updated_assignment + new_content[assignment.end():]
+
 def update_multimodal_integration():
     """Update multimodal_integration.py to support model selection."""
     integration_path = os.path.join('socratic_clarifier', 'multimodal_integration.py')
     
     if not os.path.exists(integration_path):
-        print(f"Error: {integration_path} not found")
+        log(f"Error: {integration_path} not found")
         return False
     
+    # Skip files this script already patched, before backing them up
+    if is_patched(integration_path):
+        log("Model parameter already supported in process_file function")
+        return True
+    
     backup_file(integration_path)
     
     try:
-        with open(integration_path, 'r') as f:
-            content = f.read()
+        content = read_text(integration_path)
         
-        # Check if model parameter already supported
-        if "def process_file(file_path: str, use_multimodal: bool = True, model: str = None)" in content:
-            print("Model parameter already supported in process_file function")
-            return True
-        
-        # Update the process_file function
-        process_function = content.find("def process_file(file_path: str, use_multimodal: bool = True)")
-        if process_function > 0:
-            # Update the function signature
-            updated_signature = "def process_file(file_path: str, use_multimodal: bool = True, model: str = None)"
-            new_content = content[:process_function] + updated_signature + content[process_function + len("def process_file(file_path: str, use_multimodal: bool = True)"):]
-            
-            # Find analyze_image_with_multimodal call
-            analyze_call = new_content.find("return analyze_image_with_multimodal(file_path)")
-            if analyze_call > 0:
-                # Update to pass model parameter
-                updated_call = "return analyze_image_with_multimodal(file_path, model=model)"
-                
-                # Get the line end
-                line_end = new_content.find("\n", analyze_call)
-                
-                if line_end > 0:
-                    # Replace the call
-                    new_content = new_content[:analyze_call] + updated_call + new_content[line_end:]
-                    
-                    # Now find second call to analyze_image_with_multimodal in the PDF section
-                    second_call = new_content.find("result = analyze_image_with_multimodal(temp_path)")
-                    
-                    if second_call > 0:
-                        # Update second call
-                        updated_second_call = "result = analyze_image_with_multimodal(temp_path, model=model)"
-                        
-                        # Get the line end
-                        second_line_end = new_content.find("\n", second_call)
-                        
-                        if second_line_end > 0:
-                            # Replace the call
-                            new_content = new_content[:second_call] + updated_second_call + new_content[second_line_end:]
-                        
-                    # Now update analyze_image_with_multimodal function
-                    analyze_function = new_content.find("def analyze_image_with_multimodal(image_path: str, prompt: Optional[str] = None)")
-                    
-                    if analyze_function > 0:
-                        # Update function signature
-                        updated_analyze_sig = "def analyze_image_with_multimodal(image_path: str, prompt: Optional[str] = None, model: Optional[str] = None)"
-                        new_content = new_content[:analyze_function] + updated_analyze_sig + new_content[analyze_function + len("def analyze_image_with_multimodal(image_path: str, prompt: Optional[str] = None)"):]
-                        
-                        # Find multimodal_model assignment
-                        model_assignment = new_content.find("multimodal_model = config.get", analyze_function)
-                        
-                        if model_assignment > 0:
-                            # Find the end of line
-                            assignment_end = new_content.find("\n", model_assignment)
-                            
-                            if assignment_end > 0:
-                                # Update to use passed model if provided
-                                updated_assignment = """    # Use provided model if specified, otherwise get from config
-    if model:
-        multimodal_model = model
-    else:
-        multimodal_model = config.get("integrations", {}).get("ollama", {}).get("multimodal_model", "llava:latest")"""
-                                
-                                # Replace assignment
-                                new_content = new_content[:model_assignment] + updated_assignment + new_content[assignment_end + 1:]
-                                
-                                # Write updated content
-                                with open(integration_path, 'w') as f:
-                                    f.write(new_content)
-                                
-                                print("✅ Updated multimodal_integration.py to support model selection")
-                                return True
-                            else:
-                                print("Could not find end of model assignment")
-                                return False
-                        else:
-                            print("Could not find multimodal_model assignment")
-                            return False
-                    else:
-                        print("Could not find analyze_image_with_multimodal function")
-                        return False
-                else:
-                    print("Could not find end of analyze_image_with_multimodal call")
-                    return False
-            else:
-                print("Could not find analyze_image_with_multimodal call")
-                return False
+        if LIBCST_AVAILABLE:
+            new_content = _patch_integration_by_cst(content)
         else:
-            print("Could not find process_file function")
+            new_content = _patch_integration_by_text(content)
+        if new_content is None:
             return False
-            
+        
+        if new_content == content:
+            mark_patched(integration_path)
+            log("Model parameter already supported in process_file function")
+            return True
+        
+        # Write updated content
+        atomic_write(integration_path, new_content)
+        mark_patched(integration_path)
+        
+        log("✅ Updated multimodal_integration.py to support model selection")
+        return True
+    
     except Exception as e:
-        print(f"Error updating multimodal_integration.py: {e}")
+        log(f"Error updating multimodal_integration.py: {e}")
         return False
 
 def update_api_settings():
@@ -443,18 +668,23 @@ def update_api_settings():
     settings_path = os.path.join('web_interface', 'api_settings.py')
     
     if not os.path.exists(settings_path):
-        print(f"Error: {settings_path} not found")
+        log(f"Error: {settings_path} not found")
         return False
     
+    # Skip files this script already patched, before backing them up
+    if is_patched(settings_path):
+        log("Multimodal models already included in settings response")
+        return True
+    
     backup_file(settings_path)
     
     try:
-        with open(settings_path, 'r') as f:
-            content = f.read()
+        content = read_text(settings_path)
         
         # Check if multimodal_models already included
         if "'multimodal_models': ollama_config.get('multimodal_models'," in content:
-            print("Multimodal models already included in settings response")
+            mark_patched(settings_path)
+            log("Multimodal models already included in settings response")
             return True
         
         # Find where to add multimodal_models in API response
@@ -476,23 +706,23 @@ def update_api_settings():
                     new_content = content[:multimodal_model_line] + updated_line + content[line_end + 1:]
                     
                     # Write updated content
-                    with open(settings_path, 'w') as f:
-                        f.write(new_content)
+                    atomic_write(settings_path, new_content)
+                    mark_patched(settings_path)
                     
-                    print("✅ Updated api_settings.py to include multimodal models in settings response")
+                    log("✅ Updated api_settings.py to include multimodal models in settings response")
                     return True
                 else:
-                    print("Could not find end of multimodal_model line")
+                    log("Could not find end of multimodal_model line")
                     return False
             else:
-                print("Could not find multimodal_model in settings response")
+                log("Could not find multimodal_model in settings response")
                 return False
         else:
-            print("Could not find settings route")
+            log("Could not find settings route")
             return False
             
     except Exception as e:
-        print(f"Error updating api_settings.py: {e}")
+        log(f"Error updating api_settings.py: {e}")
         return False
 
 def update_socratic_ui_template():
@@ -500,18 +730,23 @@ def update_socratic_ui_template():
     template_path = os.path.join('web_interface', 'templates', 'socratic_ui.html')
     
     if not os.path.exists(template_path):
-        print(f"Error: {template_path} not found")
+        log(f"Error: {template_path} not found")
         return False
     
+    # Skip files this script already patched, before backing them up
+    if is_patched(template_path):
+        log("Multimodal model selection already exists in socratic_ui.html")
+        return True
+    
     backup_file(template_path)
     
     try:
-        with open(template_path, 'r') as f:
-            content = f.read()
+        content = read_text(template_path)
         
         # Check if multimodal model selection already exists
         if 'id="multimodal-model-select"' in content:
-            print("Multimodal model selection already exists in socratic_ui.html")
+            mark_patched(template_path)
+            log("Multimodal model selection already exists in socratic_ui.html")
             return True
         
         # Find multimodal panel
@@ -528,120 +763,49 @@ def update_socratic_ui_template():
                 
                 if section_end > 0:
                     # Add model selection dropdown
-                    model_selection = """
-                                <div class="mb-3 mt-3">
-                                    <label for="multimodal-model-select" class="form-label">Multimodal Model:</label>
-                                    <select id="multimodal-model-select" class="form-select">
-                                        <!-- Options will be populated by JavaScript -->
-                                    </select>
-                                </div>
-"""
-                    # Insert after mode toggle
-                    new_content = content[:section_end + 6] + model_selection + content[section_end + 6:]
+                    model_selection = load_partial("socratic_model_select.html")
+                    # Insert after mode toggle; the insertions are collected against the
+                    # original template and spliced in once
+                    edits = [(section_end + 6, model_selection)]
                     
                     # Add JavaScript to populate the dropdown
                     # First check if we already have a function for this
-                    if "function populateMultimodalModels" not in new_content:
+                    if "function populateMultimodalModels" not in content:
                         # Find a good place to add the function
-                        script_section = new_content.find("<script>", 0)
+                        script_section = content.find("<script>", 0)
                         
                         if script_section > 0:
                             # Find window.onload or DOMContentLoaded
-                            dom_ready = new_content.find("document.addEventListener('DOMContentLoaded'", script_section)
+                            dom_ready = content.find("document.addEventListener('DOMContentLoaded'", script_section)
                             
                             if dom_ready > 0:
                                 # Find the function for setup
-                                setup_function = new_content.find("setupMultimodal();", dom_ready)
+                                setup_function = content.find("setupMultimodal();", dom_ready)
                                 
                                 if setup_function > 0:
-                                    # Add our function call
-                                    updated_init = "            populateMultimodalModels();\n            setupMultimodal();"
-                                    
-                                    # Replace the call
-                                    new_content = new_content[:setup_function] + updated_init + new_content[setup_function + len("setupMultimodal();"):]
+                                    # Add our function call before the setup call
+                                    edits.append((setup_function, "            populateMultimodalModels();\n            "))
                                     
                                     # Add our function
-                                    multimodal_function = """
-        // Populate multimodal model selection dropdown
-        function populateMultimodalModels() {
-            fetch('/api/settings')
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        const modelSelect = document.getElementById('multimodal-model-select');
-                        if (modelSelect) {
-                            // Clear existing options
-                            modelSelect.innerHTML = '';
-                            
-                            // Get multimodal models
-                            const multimodalModels = data.settings?.integrations?.ollama?.multimodal_models || [];
-                            const defaultModel = data.settings?.integrations?.ollama?.multimodal_model || 'llava:latest';
-                            
-                            // Add options
-                            multimodalModels.forEach(model => {
-                                const option = document.createElement('option');
-                                option.value = model;
-                                option.text = model;
-                                option.selected = (model === defaultModel);
-                                modelSelect.appendChild(option);
-                            });
-                            
-                            // Add llava:latest as fallback if not in the list
-                            if (multimodalModels.length === 0) {
-                                const option = document.createElement('option');
-                                option.value = 'llava:latest';
-                                option.text = 'llava:latest';
-                                option.selected = true;
-                                modelSelect.appendChild(option);
-                                
-                                // Also add gemma3:latest
-                                const gemmaOption = document.createElement('option');
-                                gemmaOption.value = 'gemma3:latest';
-                                gemmaOption.text = 'gemma3:latest';
-                                modelSelect.appendChild(gemmaOption);
-                            }
-                        }
-                    }
-                })
-                .catch(error => {
-                    console.error('Error loading multimodal models:', error);
-                    // Add fallback option
-                    const modelSelect = document.getElementById('multimodal-model-select');
-                    if (modelSelect) {
-                        modelSelect.innerHTML = '';
-                        
-                        const defaultOption = document.createElement('option');
-                        defaultOption.value = 'llava:latest';
-                        defaultOption.text = 'llava:latest';
-                        defaultOption.selected = true;
-                        modelSelect.appendChild(defaultOption);
-                        
-                        const gemmaOption = document.createElement('option');
-                        gemmaOption.value = 'gemma3:latest';
-                        gemmaOption.text = 'gemma3:latest';
-                        modelSelect.appendChild(gemmaOption);
-                    }
-                });
-        }
-"""
+                                    multimodal_function = load_partial("socratic_models_function.js")
                                     
                                     # Find a good place to add it - before setupMultimodal function
-                                    setup_multimodal_func = new_content.find("function setupMultimodal()", dom_ready)
+                                    setup_multimodal_func = content.find("function setupMultimodal()", dom_ready)
                                     
                                     if setup_multimodal_func > 0:
                                         # Add our function
-                                        new_content = new_content[:setup_multimodal_func] + multimodal_function + new_content[setup_multimodal_func:]
+                                        edits.append((setup_multimodal_func, multimodal_function))
                                         
                                         # Now update the processMultimodalFile function to include the selected model
-                                        process_func = new_content.find("function processMultimodalFile()")
+                                        process_func = content.find("function processMultimodalFile()")
                                         
                                         if process_func > 0:
                                             # Find form data creation
-                                            form_data = new_content.find("const formData = new FormData();", process_func)
+                                            form_data = content.find("const formData = new FormData();", process_func)
                                             
                                             if form_data > 0:
                                                 # Find where to add model selection
-                                                end_of_form_data = new_content.find("fetch(", form_data)
+                                                end_of_form_data = content.find("fetch(", form_data)
                                                 
                                                 if end_of_form_data > 0:
                                                     # Add model selection
@@ -651,49 +815,49 @@ def update_socratic_ui_template():
                 
 """
                                                     # Insert before fetch
-                                                    new_content = new_content[:end_of_form_data] + model_selection_code + new_content[end_of_form_data:]
+                                                    edits.append((end_of_form_data, model_selection_code))
                                                     
                                                     # Write updated content
-                                                    with open(template_path, 'w') as f:
-                                                        f.write(new_content)
+                                                    atomic_write(template_path, splice(content, edits))
+                                                    mark_patched(template_path)
                                                     
-                                                    print("✅ Updated socratic_ui.html to include multimodal model selection")
+                                                    log("✅ Updated socratic_ui.html to include multimodal model selection")
                                                     return True
                                                 else:
-                                                    print("Could not find end of form data section")
+                                                    log("Could not find end of form data section")
                                                     return False
                                             else:
-                                                print("Could not find form data creation")
+                                                log("Could not find form data creation")
                                                 return False
                                         else:
-                                            print("Could not find processMultimodalFile function")
+                                            log("Could not find processMultimodalFile function")
                                             return False
                                     else:
-                                        print("Could not find setupMultimodal function")
+                                        log("Could not find setupMultimodal function")
                                         return False
                                 else:
-                                    print("Could not find setupMultimodal call")
+                                    log("Could not find setupMultimodal call")
                                     return False
                             else:
-                                print("Could not find document.addEventListener('DOMContentLoaded'")
+                                log("Could not find document.addEventListener('DOMContentLoaded'")
                                 return False
                         else:
-                            print("Could not find script section")
+                            log("Could not find script section")
                             return False
                     else:
-                        print("populateMultimodalModels function already exists")
+                        log("populateMultimodalModels function already exists")
                 else:
-                    print("Could not find end of mode toggle section")
+                    log("Could not find end of mode toggle section")
                     return False
             else:
-                print("Could not find mode toggle in multimodal panel")
+                log("Could not find mode toggle in multimodal panel")
                 return False
         else:
-            print("Could not find multimodal panel")
+            log("Could not find multimodal panel")
             return False
             
     except Exception as e:
-        print(f"Error updating socratic_ui.html: {e}")
+        log(f"Error updating socratic_ui.html: {e}")
         return False
 
 def main():
@@ -703,18 +867,28 @@ def main():
     # Update config with multimodal models
     config_updated = update_config_multimodal_models()
     
-    # Update multimodal integration to support model selection
-    integration_updated = update_multimodal_integration()
-    
-    # Update routes to support model selection
-    routes_updated = update_routes_multimodal()
-    
-    # Update API settings
-    api_updated = update_api_settings()
+    # The remaining updates each patch a different file, so run them side by side.
+    # Each step's messages are collected and printed together, in order, once it is done.
+    steps = [
+        # Update multimodal integration to support model selection
+        update_multimodal_integration,
+        # Update routes to support model selection
+        update_routes_multimodal,
+        # Update API settings
+        update_api_settings,
+        # Update templates
+        update_multimodal_template,
+        update_socratic_ui_template,
+    ]
+    results = []
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for future in [executor.submit(_run_step, step) for step in steps]:
+            result, lines = future.result()
+            for line in lines:
+                print(line)
+            results.append(result)
     
-    # Update templates
-    template_updated = update_multimodal_template()
-    socratic_updated = update_socratic_ui_template()
+    integration_updated, routes_updated, api_updated, template_updated, socratic_updated = results
     
     # Print summary
     print("\n=== Fix Summary ===")
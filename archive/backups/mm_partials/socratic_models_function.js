@@ -0,0 +1,65 @@
+
+        // Populate multimodal model selection dropdown
+        function populateMultimodalModels() {
+            // Share one /api/settings request between everything on the page that needs it
+            window.scSettingsPromise = window.scSettingsPromise || fetch('/api/settings').then(response => response.json());
+            window.scSettingsPromise
+                .then(data => {
+                    if (data.success) {
+                        const modelSelect = document.getElementById('multimodal-model-select');
+                        if (modelSelect) {
+                            // Clear existing options
+                            modelSelect.innerHTML = '';
+                            
+                            // Get multimodal models
+                            const multimodalModels = data.settings?.integrations?.ollama?.multimodal_models || [];
+                            const defaultModel = data.settings?.integrations?.ollama?.multimodal_model || 'llava:latest';
+                            
+                            // Add options
+                            multimodalModels.forEach(model => {
+                                const option = document.createElement('option');
+                                option.value = model;
+                                option.text = model;
+                                option.selected = (model === defaultModel);
+                                modelSelect.appendChild(option);
+                            });
+                            
+                            // Add llava:latest as fallback if not in the list
+                            if (multimodalModels.length === 0) {
+                                const option = document.createElement('option');
+                                option.value = 'llava:latest';
+                                option.text = 'llava:latest';
+                                option.selected = true;
+                                modelSelect.appendChild(option);
+                                
+                                // Also add gemma3:latest
+                                const gemmaOption = document.createElement('option');
+                                gemmaOption.value = 'gemma3:latest';
+                                gemmaOption.text = 'gemma3:latest';
+                                modelSelect.appendChild(gemmaOption);
+                            }
+                        }
+                    }
+                })
+                .catch(error => {
+                    console.error('Error loading multimodal models:', error);
+                    // Let the next caller retry instead of reusing the failed request
+                    window.scSettingsPromise = null;
+                    // Add fallback option
+                    const modelSelect = document.getElementById('multimodal-model-select');
+                    if (modelSelect) {
+                        modelSelect.innerHTML = '';
+                        
+                        const defaultOption = document.createElement('option');
+                        defaultOption.value = 'llava:latest';
+                        defaultOption.text = 'llava:latest';
+                        defaultOption.selected = true;
+                        modelSelect.appendChild(defaultOption);
+                        
+                        const gemmaOption = document.createElement('option');
+                        gemmaOption.value = 'gemma3:latest';
+                        gemmaOption.text = 'gemma3:latest';
+                        modelSelect.appendChild(gemmaOption);
+                    }
+                });
+        }
@@ -4,26 +4,113 @@ Script to initialize custom detection patterns.
 This creates a custom_patterns directory and adds some default patterns.
 """
 
-import os
+import re
 import json
+from pathlib import Path
+
+# orjson is optional; JSON output falls back to the stdlib json module
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# msgpack is optional; without it only the per-category JSON files are written
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+# Hyperscan is optional; pattern scanning falls back to the re module without it
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    HYPERSCAN_AVAILABLE = False
 
 def ensure_dir(directory):
     """Create a directory if it doesn't exist."""
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-        print(f"Created directory: {directory}")
+    Path(directory).mkdir(parents=True, exist_ok=True)
 
 def write_patterns(filename, patterns):
     """Write patterns to a JSON file."""
-    with open(filename, 'w') as f:
-        json.dump(patterns, f, indent=2)
+    if ORJSON_AVAILABLE:
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(patterns, option=orjson.OPT_INDENT_2))
+    else:
+        with open(filename, 'w') as f:
+            json.dump(patterns, f, indent=2)
     print(f"Wrote {len(patterns)} patterns to {filename}")
 
+def write_patterns_bundle(filename, categories):
+    """Write every category's patterns to a single msgpack file."""
+    with open(filename, 'wb') as f:
+        f.write(msgpack.packb(categories))
+    print(f"Wrote {len(categories)} pattern categories to {filename}")
+
+def build_hyperscan_db(categories):
+    """Compile every category's patterns into one Hyperscan block-mode database.
+
+    Returns (db, ids) where ids[i] is the (category, pattern_index) pair for
+    Hyperscan expression id i.
+    """
+    ids = [(name, i) for name, patterns in categories.items() for i in range(len(patterns))]
+    expressions = [categories[name][i].encode() for name, i in ids]
+    db = hyperscan.Database()
+    db.compile(
+        expressions=expressions,
+        ids=list(range(len(ids))),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_UTF8] * len(ids)
+    )
+    return db, ids
+
+def scan_patterns(categories, text, db=None, ids=None):
+    """Find all pattern matches in text as (category, pattern_index, start, end).
+
+    Uses a single Hyperscan pass when a database is given, otherwise falls back
+    to running each compiled pattern with the re module. Both return character
+    offsets and, per pattern, non-overlapping matches in the same order
+    (Hyperscan's \\w and \\b only treat ASCII characters as word characters).
+    """
+    matches = []
+    if db is not None:
+        data = text.encode()
+        # Hyperscan reports every end offset; keep the longest match at each start
+        ends = {}
+        def on_match(match_id, start, end, flags, context):
+            if end > ends.get((match_id, start), -1):
+                ends[(match_id, start)] = end
+        db.scan(data, match_event_handler=on_match)
+        
+        # Map byte offsets back to character offsets
+        if len(data) == len(text):
+            char_offsets = range(len(data) + 1)
+        else:
+            char_offsets = [i for i, ch in enumerate(text) for _ in range(len(ch.encode()))] + [len(text)]
+        
+        # Drop matches overlapping an earlier match of the same pattern, as re.finditer does
+        last_end = {}
+        for (match_id, start), end in sorted(ends.items()):
+            if start < last_end.get(match_id, 0):
+                continue
+            last_end[match_id] = end
+            name, index = ids[match_id]
+            matches.append((name, index, char_offsets[start], char_offsets[end]))
+        return matches
+
+    for name, patterns in categories.items():
+        for index, pattern in enumerate(patterns):
+            for match in re.finditer(pattern, text, re.IGNORECASE):
+                matches.append((name, index, match.start(), match.end()))
+    return matches
+
 def main():
     """Initialize custom detection patterns."""
     # Create custom_patterns directory
-    patterns_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'custom_patterns')
+    patterns_dir = Path(__file__).resolve().parent / 'custom_patterns'
     ensure_dir(patterns_dir)
+    categories = {}
     
     # Initialize vague term patterns
     vague_patterns = [
@@ -31,14 +118,18 @@ def main():
         r'\b(?:recently|soon|later|earlier|sometimes|occasionally|often|frequently)\b',
         r'\b(?:good|bad|better|worse|best|worst|greatest|improved|effective)\b'
     ]
-    write_patterns(os.path.join(patterns_dir, 'vague.json'), vague_patterns)
+    vague_file = patterns_dir / 'vague.json'
+    write_patterns(vague_file, vague_patterns)
+    categories['vague'] = vague_patterns
     
     # Initialize gender bias patterns
     gender_bias_patterns = [
         r'\b(?:mankind|manpower|manmade|chairman|policeman|fireman|stewardess|mailman)\b',
         r'\b(?:he|his|him)\b(?:\s+or\s+(?:she|her))?'  # Male default
     ]
-    write_patterns(os.path.join(patterns_dir, 'gender_bias.json'), gender_bias_patterns)
+    gender_bias_file = patterns_dir / 'gender_bias.json'
+    write_patterns(gender_bias_file, gender_bias_patterns)
+    categories['gender_bias'] = gender_bias_patterns
     
     # Initialize stereotype patterns
     stereotype_patterns = [
@@ -46,14 +137,22 @@ def main():
         r'\b(?:women|men)\s+(?:are better|are worse|can\'t|always|never)\b',
         r'\b(?:USA|America|United States|country)\s+(?:is|are)\s+(?:the\s+)?(?:greatest|best|worst|most)\b'
     ]
-    write_patterns(os.path.join(patterns_dir, 'stereotype.json'), stereotype_patterns)
+    stereotype_file = patterns_dir / 'stereotype.json'
+    write_patterns(stereotype_file, stereotype_patterns)
+    categories['stereotype'] = stereotype_patterns
     
     # Initialize non-inclusive patterns
     non_inclusive_patterns = [
         r'\b(?:blacklist|whitelist|master|slave|crazy|insane|lame|retarded|crippled)\b',
         r'\b(?:illegal alien|colored people|oriental|gypped|jewed|ghetto)\b'
     ]
-    write_patterns(os.path.join(patterns_dir, 'non_inclusive.json'), non_inclusive_patterns)
+    non_inclusive_file = patterns_dir / 'non_inclusive.json'
+    write_patterns(non_inclusive_file, non_inclusive_patterns)
+    categories['non_inclusive'] = non_inclusive_patterns
+    
+    # Write all categories to one bundle; the JSON files remain for compatibility
+    if MSGPACK_AVAILABLE:
+        write_patterns_bundle(patterns_dir / 'patterns.mp', categories)
     
     print("Custom patterns initialization complete!")
 
@@ -11,6 +11,13 @@ from pathlib import Path
 import traceback
 from loguru import logger
 
+# msgpack is optional; custom patterns are read from the per-category JSON files without it
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -54,6 +61,23 @@ def load_custom_patterns():
         os.makedirs(patterns_dir, exist_ok=True)
         return patterns
     
+    # Read every category from the bundle written by add_custom_patterns.py, unless
+    # a category file has been saved since (the settings page writes the JSON files)
+    bundle_file = os.path.join(patterns_dir, 'patterns.mp')
+    json_mtimes = [os.path.getmtime(path) for path in
+                   (os.path.join(patterns_dir, f'{pattern_type}.json') for pattern_type in patterns)
+                   if os.path.exists(path)]
+    if (MSGPACK_AVAILABLE and os.path.exists(bundle_file)
+            and os.path.getmtime(bundle_file) >= max(json_mtimes, default=0)):
+        try:
+            with open(bundle_file, 'rb') as f:
+                bundle = msgpack.unpackb(f.read(), raw=False)
+            for pattern_type in patterns.keys():
+                patterns[pattern_type] = bundle.get(pattern_type, [])
+            return patterns
+        except Exception as e:
+            logger.error(f"Error loading custom pattern bundle, falling back to JSON files: {e}")
+    
     for pattern_type in patterns.keys():
         pattern_file = os.path.join(patterns_dir, f'{pattern_type}.json')
         if os.path.exists(pattern_file):
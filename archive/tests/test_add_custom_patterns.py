@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Test file for add_custom_patterns.py.
+Checks that the Hyperscan and re backends of scan_patterns report the same matches.
+"""
+
+import os
+import sys
+import unittest
+
+# Add the scripts directory to path so we can import the module
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from add_custom_patterns import HYPERSCAN_AVAILABLE, build_hyperscan_db, scan_patterns
+
+CATEGORIES = {
+    'vague': [
+        r'\b(?:significant|substantial|several|various|most|many|some|few)\b',
+        r'\b(?:good|bad|better|worse|best|worst|greatest|improved|effective)\b'
+    ],
+    'gender_bias': [
+        r'\b(?:mankind|manpower|manmade|chairman|policeman|fireman|stewardess|mailman)\b',
+        r'\b(?:he|his|him)\b(?:\s+or\s+(?:she|her))?'
+    ],
+    'stereotype': [
+        r'\ball\s+(?:\w+\s+)*(?:women|men|asians|africans|latinos|elderly|millennials)\s+(?:are|have|do)\b'
+    ]
+}
+
+TEXTS = [
+    "He or she should ask the chairman; his answer was the best of many.",
+    "Café owners say some policemen are good — the chairman agreed with him or her.",
+    "All young men are said to be better, and all elderly women have several ideas.",
+    "Nothing to see here."
+]
+
+@unittest.skipUnless(HYPERSCAN_AVAILABLE, "hyperscan is not installed")
+class TestScanPatterns(unittest.TestCase):
+    def test_backends_agree(self):
+        """The Hyperscan path returns the same character offsets and matches as the re path."""
+        db, ids = build_hyperscan_db(CATEGORIES)
+        for text in TEXTS:
+            with self.subTest(text=text):
+                self.assertEqual(scan_patterns(CATEGORIES, text, db, ids), scan_patterns(CATEGORIES, text))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,14 @@ without full features. It serves as a fallback when the full implementation is u
 import os
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# orjson is optional; index reads fall back to the stdlib json module
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -33,6 +41,10 @@ class EnhancedDocumentManager:
         self.storage_dir = storage_dir
         self.index_file = os.path.join(storage_dir, 'document_index.json')
         
+        # Cached document stats, valid while the index file mtime is unchanged
+        self._stats_cache = None
+        self._index_mtime = None
+        
         # Ensure directories exist
         os.makedirs(storage_dir, exist_ok=True)
         
@@ -46,11 +58,34 @@ class EnhancedDocumentManager:
         
         logger.info(f"Simplified Document Manager initialized with storage at: {storage_dir}")
     
+    def _load_index(self):
+        """Load and return the document index."""
+        if ORJSON_AVAILABLE:
+            with open(self.index_file, 'rb') as f:
+                return orjson.loads(f.read())
+        with open(self.index_file, 'r') as f:
+            return json.load(f)
+    
+    def _read_document_text(self, doc):
+        """Read the extracted text for a document record."""
+        # Check for text_path
+        text_path = doc.get("text_path")
+        if text_path and os.path.exists(text_path):
+            with open(text_path, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        
+        # Alternate: check for file_path + .txt
+        file_path = doc.get("file_path") or doc.get("raw_path")
+        if file_path and os.path.exists(f"{file_path}.txt"):
+            with open(f"{file_path}.txt", 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        
+        return "Document content not available."
+    
     def get_document_by_id(self, doc_id):
         """Get document metadata by ID."""
         try:
-            with open(self.index_file, 'r') as f:
-                index_data = json.load(f)
+            index_data = self._load_index()
             
             for doc in index_data.get("documents", []):
                 if doc.get("id") == doc_id:
@@ -68,22 +103,61 @@ class EnhancedDocumentManager:
             if not doc:
                 return None
             
-            # Check for text_path
-            text_path = doc.get("text_path")
-            if text_path and os.path.exists(text_path):
-                with open(text_path, 'r', encoding='utf-8', errors='replace') as f:
-                    return f.read()
-            
-            # Alternate: check for file_path + .txt
-            file_path = doc.get("file_path") or doc.get("raw_path")
-            if file_path and os.path.exists(f"{file_path}.txt"):
-                with open(f"{file_path}.txt", 'r', encoding='utf-8', errors='replace') as f:
-                    return f.read()
-            
-            return "Document content not available."
+            return self._read_document_text(doc)
         except Exception as e:
             logger.error(f"Error getting document content: {e}")
             return None
+    
+    def get_document_contents_bulk(self, doc_ids):
+        """
+        Get the text content of several documents at once.
+        
+        The index is read once and the text files are read in parallel.
+        
+        Args:
+            doc_ids: Iterable of document IDs
+            
+        Returns:
+            Dict mapping each found document ID to its text content
+        """
+        try:
+            wanted = set(doc_ids)
+            if not wanted:
+                return {}
+            
+            docs = [doc for doc in self._load_index().get("documents", [])
+                    if doc.get("id") in wanted]
+            
+            with ThreadPoolExecutor(max_workers=min(8, len(docs) or 1)) as executor:
+                contents = executor.map(self._read_document_text, docs)
+                return {doc["id"]: content for doc, content in zip(docs, contents)}
+        except Exception as e:
+            logger.error(f"Error getting document contents: {e}")
+            return {}
+
+    def get_document_stats(self):
+        """
+        Get summary statistics about the document library.
+        
+        The stats are cached and only recomputed when the index file changes.
+        
+        Returns:
+            Dict with total_documents and with_embeddings counts
+        """
+        mtime = os.stat(self.index_file).st_mtime
+        if self._stats_cache is not None and mtime == self._index_mtime:
+            return self._stats_cache
+        
+        documents = self._load_index().get("documents", [])
+        self._stats_cache = {
+            "total_documents": len(documents),
+            "with_embeddings": sum(
+                1 for doc in documents
+                if doc.get("has_embeddings") or doc.get("embedding_file") or doc.get("embedding_path")
+            )
+        }
+        self._index_mtime = mtime
+        return self._stats_cache
 
 # Create a singleton instance
 _document_manager = None
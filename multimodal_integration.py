@@ -441,6 +441,16 @@ def update_config_for_multimodal():
         return False
 
 
+# Use the advanced RAG implementations when enabled in config.json
+try:
+    from web_interface.rag_v2 import advanced_rag_enabled
+    if advanced_rag_enabled():
+        from web_interface.rag_v2 import process_file, analyze_image_with_multimodal
+except ImportError as e:
+    # The web interface dependencies are not installed; keep the functions above
+    print(f"Advanced RAG implementations not available: {e}")
+
+
 if __name__ == "__main__":
     # Check dependencies and update config
     if check_dependencies():
@@ -0,0 +1,77 @@
+"""
+Persistent cache of text embeddings for document RAG.
+
+Embeddings are stored in SQLite keyed by the SHA-256 of the embedded text,
+the provider and the model, so re-indexing unchanged documents or repeating
+a query does not call the embedding API again.
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Cache database, stored alongside the document index
+EMBED_CACHE_FILE = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', 'document_storage', 'embedding_cache.sqlite'))
+
+# Keep each SELECT under SQLite's default limit on bound parameters
+_MAX_PARAMS = 500
+
+_local = threading.local()
+
+
+def _connection() -> sqlite3.Connection:
+    """Return this thread's connection, creating the cache table if needed."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(EMBED_CACHE_FILE), exist_ok=True)
+        conn = sqlite3.connect(EMBED_CACHE_FILE)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "hash TEXT, provider TEXT, model TEXT, vec BLOB, "
+            "PRIMARY KEY (hash, provider, model))"
+        )
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def text_hash(text: str) -> str:
+    """Return the cache key for a text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_many(hashes: List[str], provider: str, model: str) -> Dict[str, np.ndarray]:
+    """
+    Look up cached embeddings.
+    Returns a dict mapping each cached hash to its float32 vector.
+    """
+    conn = _connection()
+    unique = list(dict.fromkeys(hashes))
+    found = {}
+    for start in range(0, len(unique), _MAX_PARAMS):
+        batch = unique[start:start + _MAX_PARAMS]
+        placeholders = ",".join("?" * len(batch))
+        rows = conn.execute(
+            f"SELECT hash, vec FROM embedding_cache "
+            f"WHERE provider = ? AND model = ? AND hash IN ({placeholders})",
+            [provider, model, *batch]
+        )
+        for h, vec in rows:
+            found[h] = np.frombuffer(vec, dtype=np.float32)
+    return found
+
+
+def put_many(items: Iterable[Tuple[str, str, str, np.ndarray]]) -> None:
+    """Store embeddings given as (hash, provider, model, vector) tuples."""
+    conn = _connection()
+    conn.executemany(
+        "INSERT OR REPLACE INTO embedding_cache (hash, provider, model, vec) VALUES (?, ?, ?, ?)",
+        [(h, provider, model, np.asarray(vec, dtype=np.float32).tobytes())
+         for h, provider, model, vec in items]
+    )
+    conn.commit()
@@ -245,6 +245,51 @@ def generate_socratic_questions(text, issues, sot_paradigm=None, max_questions=5
     # Limit to the requested number of questions
     return questions[:max_questions]
 
+def _build_document_text_v1(text, document_context):
+    """
+    Format document context for the analysis prompt.
+    
+    Args:
+        text (str): The user query
+        document_context (list): List of document contexts
+        
+    Returns:
+        str: The formatted document text, or an empty string without context
+    """
+    document_text = ""
+    if document_context:
+        logger.info(f"Processing document context with {len(document_context)} documents")
+        # Basic document integration - include document content for proper analysis
+        document_text = f"USER QUERY: {text}\n\n"
+        document_text += "DOCUMENT CONTENT TO ANALYZE:\n"
+        
+        for i, doc in enumerate(document_context):
+            if isinstance(doc, dict) and "content" in doc:
+                content = doc.get("content", "")
+                filename = doc.get("filename", f"Document {i+1}")
+                
+                if content:
+                    document_text += f"\n----- DOCUMENT {i+1}: {filename} -----\n"
+                    document_text += f"{content}\n"
+        
+        # Add better analysis instructions
+        document_text += "\n\nINSTRUCTIONS FOR ANALYSIS:\n"
+        document_text += "1. Analyze the DOCUMENT CONTENT above in relation to the USER QUERY.\n"
+        document_text += "2. Identify issues in the document content, not in the user's query.\n"
+        document_text += "3. Focus on analyzing the actual document text rather than the query itself.\n"
+    
+    return document_text
+
+# Use the advanced RAG document context formatting when enabled in config.json
+build_document_text = _build_document_text_v1
+try:
+    from web_interface.rag_v2 import advanced_rag_enabled, build_document_context
+    if advanced_rag_enabled():
+        build_document_text = build_document_context
+        logger.info("Using advanced RAG document context formatting")
+except ImportError as e:
+    logger.warning(f"Advanced RAG implementations not available: {e}")
+
 def direct_analyze_text(text, mode="standard", use_sot=True, max_questions=5, document_context=None):
     """
     Analyze text using direct Ollama integration and SoT.
@@ -302,27 +347,7 @@ def direct_analyze_text(text, mode="standard", use_sot=True, max_questions=5, do
         document_context = []
     
     # Process any document context if provided
-    document_text = ""
-    if document_context:
-        logger.info(f"Processing document context with {len(document_context)} documents")
-        # Basic document integration - include document content for proper analysis
-        document_text = f"USER QUERY: {text}\n\n"
-        document_text += "DOCUMENT CONTENT TO ANALYZE:\n"
-        
-        for i, doc in enumerate(document_context):
-            if isinstance(doc, dict) and "content" in doc:
-                content = doc.get("content", "")
-                filename = doc.get("filename", f"Document {i+1}")
-                
-                if content:
-                    document_text += f"\n----- DOCUMENT {i+1}: {filename} -----\n"
-                    document_text += f"{content}\n"
-        
-        # Add better analysis instructions
-        document_text += "\n\nINSTRUCTIONS FOR ANALYSIS:\n"
-        document_text += "1. Analyze the DOCUMENT CONTENT above in relation to the USER QUERY.\n"
-        document_text += "2. Identify issues in the document content, not in the user's query.\n"
-        document_text += "3. Focus on analyzing the actual document text rather than the query itself.\n"
+    document_text = build_document_text(text, document_context)
 
     # Use Ollama to detect issues
     prompt = f"""
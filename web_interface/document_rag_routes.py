@@ -36,6 +36,9 @@ document_rag_bp = Blueprint('document_rag', __name__)
 DOCUMENT_STORAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'document_storage'))
 DOCUMENT_INDEX_FILE = os.path.join(DOCUMENT_STORAGE_DIR, 'document_index.json')
 
+# Length of the document snippet stored in the index for RAG prompting
+RAG_SNIPPET_LENGTH = 1000
+
 # Create storage directory if it doesn't exist
 os.makedirs(DOCUMENT_STORAGE_DIR, exist_ok=True)
 
@@ -120,6 +123,8 @@ def add_document_to_index(
             "file_size": file_size,
             "upload_date": datetime.datetime.now().isoformat(),
             "text_content_length": len(text_content),
+            "snippet": (text_content[:RAG_SNIPPET_LENGTH] + "..."
+                        if len(text_content) > RAG_SNIPPET_LENGTH else text_content),
             "embedding_file": embedding_file,
             "processed": True
         }
@@ -559,3 +564,13 @@ def cleanup_document_index():
             'success': False,
             'error': str(e)
         }), 500
+
+
+# Use the advanced RAG implementations when enabled in config.json
+try:
+    from web_interface.rag_v2 import advanced_rag_enabled
+    if advanced_rag_enabled():
+        from web_interface.rag_v2 import retrieve_relevant_context, process_document_for_rag
+        logger.info("Using advanced RAG retrieval and document processing")
+except ImportError as e:
+    logger.warning(f"Advanced RAG implementations not available: {e}")
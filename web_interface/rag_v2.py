@@ -0,0 +1,1200 @@
+"""
+Advanced RAG implementations for AI-Socratic-Clarifier.
+
+Drop-in replacements for the document context, retrieval, document processing
+and multimodal functions. document_rag_routes.py, direct_integration.py and
+multimodal_integration.py switch to them when settings.advanced_rag is
+enabled in config.json.
+"""
+
+import io
+import os
+import json
+import time
+import base64
+import pickle
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from loguru import logger
+
+from web_interface import _embed_cache
+from web_interface.scoring import PARAGRAPH_RE, tokenize, build_term_arrays, bm25_scores
+
+# orjson is optional; config and chunk metadata fall back to the stdlib json module
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# pyahocorasick is optional; term positions fall back to str.find
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# FAISS is optional; retrieval falls back to keyword scoring without it
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+def _load_multimodal():
+    """
+    Import multimodal_integration on first use.
+    It imports this module when it loads, so importing it at module level would be circular.
+    Raises ImportError if it is not available.
+    """
+    import multimodal_integration
+    return multimodal_integration
+
+
+DOCUMENT_STORAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'document_storage'))
+DOCUMENT_INDEX_FILE = os.path.join(DOCUMENT_STORAGE_DIR, 'document_index.json')
+
+
+def _read_json(path: str) -> Any:
+    """Parse a JSON file, with orjson when available."""
+    if ORJSON_AVAILABLE:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _loads(data: bytes) -> Any:
+    """Parse JSON bytes, with orjson when available."""
+    return orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+
+
+def _write_json(path: str, data: Any) -> None:
+    """Write data to a JSON file, with orjson when available."""
+    if ORJSON_AVAILABLE:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+
+def get_document_index() -> Dict[str, Any]:
+    """Load and return the document index from the index file."""
+    try:
+        return _read_json(DOCUMENT_INDEX_FILE)
+    except Exception as e:
+        logger.error(f"Error loading document index: {e}")
+        return {"documents": []}
+
+
+# Parsed config.json, reloaded only when the file's mtime changes
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+_CONFIG_CACHE = {"mtime": 0, "data": {}}
+
+
+def _get_config() -> Dict[str, Any]:
+    """Return the parsed config.json, re-reading it only after it changes."""
+    try:
+        st = os.stat(CONFIG_PATH)
+    except OSError:
+        return {}
+    if st.st_mtime != _CONFIG_CACHE["mtime"]:
+        try:
+            _CONFIG_CACHE["data"] = _read_json(CONFIG_PATH)
+            _CONFIG_CACHE["mtime"] = st.st_mtime
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read config.json: {e}")
+    return _CONFIG_CACHE["data"]
+
+
+def advanced_rag_enabled() -> bool:
+    """Return whether config.json enables the advanced RAG implementations."""
+    return bool(_get_config().get("settings", {}).get("advanced_rag", False))
+
+
+# Windowed RAG: documents are offered to the model one window at a time and
+# the first window it considers sufficient is used for the analysis
+RAG_WINDOW_CHARS = 4000
+INSUFFICIENT_REPLY = "INSUFFICIENT"
+
+
+def _build_context_windows(document_context, window_chars=RAG_WINDOW_CHARS):
+    """
+    Split ranked document context into windows of about window_chars characters.
+    Returns a list of windows, each a list of {"filename", "relevance", "content"} dicts.
+    """
+    windows = []
+    current = []
+    current_chars = 0
+    for i, doc in enumerate(document_context):
+        if not isinstance(doc, dict) or not doc.get("content"):
+            continue
+        content = doc["content"]
+        filename = doc.get("filename", f"Document {i+1}")
+        start = 0
+        while start < len(content):
+            piece = content[start:start + window_chars - current_chars]
+            current.append({"filename": filename, "relevance": doc.get("relevance"), "content": piece})
+            current_chars += len(piece)
+            start += len(piece)
+            if current_chars >= window_chars:
+                windows.append(current)
+                current = []
+                current_chars = 0
+    if current:
+        windows.append(current)
+    return windows
+
+
+def _select_context_window(windows, text, model):
+    """
+    Return the first window the model considers sufficient for analyzing text.
+    Falls back to the highest-ranked window if none is.
+    """
+    system_prompt = (
+        "You decide whether reference passages contain enough information to analyze a user statement. "
+        f"If the passages are insufficient, respond only with {INSUFFICIENT_REPLY}."
+    )
+    for number, window in enumerate(windows, start=1):
+        passages = "\n\n".join(f"[{section['filename']}]\n{section['content']}" for section in window)
+        try:
+            response = _OLLAMA_SESSION.post(
+                "http://localhost:11434/api/chat",
+                json={
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"PASSAGES:\n{passages}\n\nUSER STATEMENT: {text}"}
+                    ],
+                    "stream": False,
+                    "options": {"num_predict": 16}
+                },
+                timeout=60
+            )
+            response.raise_for_status()
+            reply = response.json().get("message", {}).get("content", "")
+        except Exception as e:
+            logger.warning(f"Window sufficiency check failed, using window {number}: {e}")
+            return window
+        if INSUFFICIENT_REPLY not in reply.upper():
+            logger.info(f"Using document window {number} of {len(windows)}")
+            return window
+    return windows[0] if windows else []
+
+
+def build_document_context(text: str, document_context: List[Dict[str, Any]]) -> str:
+    """
+    Format document context for the analysis prompt.
+    Returns an empty string if there is no document context.
+    """
+    document_text = ""
+    if document_context:
+        logger.info(f"Processing document context with {len(document_context)} documents")
+        
+        # Get config to check context limits
+        cfg = _get_config()
+        context_limit = cfg.get("settings", {}).get("rag_context_limit", 50000)
+        
+        # With settings.windowed_rag, offer the ranked documents in windows instead of filling the whole context limit
+        context_docs = document_context
+        if cfg.get("settings", {}).get("windowed_rag", False):
+            model = cfg.get("integrations", {}).get("ollama", {}).get("default_model", "gemma3:latest")
+            context_docs = _select_context_window(_build_context_windows(document_context), text, model)
+        
+        # Format document content with clear structure and more content
+        parts = ["\n\n===== REFERENCE DOCUMENTS =====\n"]
+        total_chars = 0
+        
+        for i, doc in enumerate(context_docs):
+            if isinstance(doc, dict) and "content" in doc:
+                content = doc.get("content", "")
+                filename = doc.get("filename", f"Document {i+1}")
+                relevance = doc.get("relevance", None)
+                
+                if content:
+                    doc_header = f"\n----- DOCUMENT {i+1}: {filename}"
+                    if relevance:
+                        doc_header += f" (Relevance: {relevance:.2f})"
+                    doc_header += " -----\n"
+                    
+                    parts.append(doc_header)
+                    
+                    # Add as much content as possible within the limits
+                    content_to_add = content
+                    # Check if adding this would exceed our context limit
+                    if total_chars + len(content_to_add) > context_limit:
+                        # Truncate to fit within limit
+                        available_chars = max(0, context_limit - total_chars)
+                        if available_chars > 100:  # Only add if we can add a meaningful amount
+                            content_to_add = content[:available_chars] + "... [content truncated to fit context window]"
+                        else:
+                            # Skip this document if we can't add enough content
+                            parts.append("Document content omitted to fit context window.\n")
+                            continue
+                    
+                    parts.append(content_to_add)
+                    parts.append("\n")
+                    total_chars += len(doc_header) + len(content_to_add)
+                    
+                    # If we've exceeded our context limit, stop adding documents
+                    if total_chars >= context_limit:
+                        parts.append("\n[Additional documents omitted to fit context window]")
+                        break
+        
+        # Add clear instructions for the LLM
+        parts.append(
+            "\n\n===== INSTRUCTIONS =====\n"
+            "1. Use the information from the REFERENCE DOCUMENTS above to inform your analysis\n"
+            "2. Cite specific information from documents when relevant to the analysis\n"
+            "3. Acknowledge if the information in the documents contradicts or supports the user statement\n"
+            "4. Do not fabricate information that is not in the documents or the user's statement\n\n"
+        )
+        
+        document_text = "".join(parts)
+        logger.info(f"Added {total_chars} characters of document context from {len(context_docs)} sections")
+    
+    return document_text
+
+
+# Semantic chunk index used by retrieve_relevant_context
+OLLAMA_EMBED_URL = "http://localhost:11434/api/embed"
+EMBEDDING_PROVIDER = "ollama"
+EMBED_BATCH_SIZE = 64
+
+# Shared session so embedding and multimodal requests reuse TCP connections to Ollama
+_OLLAMA_SESSION = requests.Session()
+_OLLAMA_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+CHUNK_INDEX_FILE = os.path.join(DOCUMENT_STORAGE_DIR, 'chunk_index.faiss')
+CHUNK_META_FILE = os.path.join(DOCUMENT_STORAGE_DIR, 'chunk_index.json')
+
+# Inner-product index over L2-normalized chunk embeddings, with chunk text and
+# metadata stored at the same positions in _CHUNKS
+_INDEX = None
+_CHUNKS: List[Dict[str, Any]] = []
+_INDEX_LOCK = threading.Lock()
+
+# Chunks less similar than this to the query are not returned
+MIN_CHUNK_RELEVANCE = 0.40
+
+# Semantic query cache settings: paraphrased follow-up queries reuse earlier results
+QUERY_CACHE_CAPACITY = 256
+QUERY_CACHE_THRESHOLD = 0.95
+QUERY_CACHE_TTL = 300
+_QUERY_CACHE = None
+
+
+class ProximityCache:
+    """
+    LRU cache of retrieval results keyed by normalized query embedding.
+    A lookup hits when a cached query is at least `threshold` cosine-similar
+    to the new one and the entry is younger than `ttl` seconds.
+    """
+    
+    def __init__(self, dim: int, capacity: int = QUERY_CACHE_CAPACITY,
+                 threshold: float = QUERY_CACHE_THRESHOLD, ttl: float = QUERY_CACHE_TTL):
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> (results, limit, timestamp)
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._next_id = 0
+        self._lock = threading.Lock()
+    
+    def get(self, q: "np.ndarray", limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Return cached results for a near-identical query, or None."""
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            D, I = self.index.search(q, 1)
+            key = int(I[0][0])
+            if key < 0 or D[0][0] < self.threshold:
+                return None
+            
+            results, cached_limit, timestamp = self.entries[key]
+            if time.time() - timestamp >= self.ttl:
+                self._remove(key)
+                return None
+            if cached_limit < limit:
+                return None
+            
+            self.entries.move_to_end(key)
+            return results[:limit]
+    
+    def put(self, q: "np.ndarray", results: List[Dict[str, Any]], limit: int) -> None:
+        """Cache results for a query, evicting the least recently used entries."""
+        with self._lock:
+            key = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(q, np.array([key], dtype=np.int64))
+            self.entries[key] = (results, limit, time.time())
+            while len(self.entries) > self.capacity:
+                self._remove(next(iter(self.entries)))
+    
+    def clear(self) -> None:
+        """Drop all cached results."""
+        with self._lock:
+            self.index.reset()
+            self.entries.clear()
+    
+    def _remove(self, key: int) -> None:
+        self.index.remove_ids(np.array([key], dtype=np.int64))
+        del self.entries[key]
+
+
+def get_embedding_model() -> str:
+    """Return the configured Ollama embedding model."""
+    config = current_app.config.get('CLARIFIER_CONFIG', {})
+    return config.get('integrations', {}).get('ollama', {}).get('default_embedding_model', 'nomic-embed-text')
+
+
+def ollama_embed_batch(texts: List[str], model: str, batch: int = EMBED_BATCH_SIZE) -> "np.ndarray":
+    """
+    Embed texts with Ollama, sending up to `batch` texts per request.
+    Returns a float32 array with one row per text.
+    """
+    groups = []
+    for start in range(0, len(texts), batch):
+        response = _OLLAMA_SESSION.post(
+            OLLAMA_EMBED_URL, json={"model": model, "input": texts[start:start + batch]}, timeout=120)
+        response.raise_for_status()
+        groups.append(np.asarray(response.json()["embeddings"], dtype=np.float32))
+    return np.vstack(groups)
+
+
+def embed_texts(texts: List[str]) -> "np.ndarray":
+    """
+    Embed texts, only calling Ollama for texts not in the embedding cache.
+    Returns a float32 array of L2-normalized vectors, one row per text.
+    """
+    model = get_embedding_model()
+    hashes = [_embed_cache.text_hash(text) for text in texts]
+    cached = _embed_cache.get_many(hashes, EMBEDDING_PROVIDER, model)
+    
+    misses = {}
+    for text, h in zip(texts, hashes):
+        if h not in cached:
+            misses.setdefault(h, text)
+    if misses:
+        new_vectors = ollama_embed_batch(list(misses.values()), model)
+        new_items = dict(zip(misses, new_vectors))
+        _embed_cache.put_many((h, EMBEDDING_PROVIDER, model, vec) for h, vec in new_items.items())
+        cached.update(new_items)
+    
+    vecs = np.vstack([cached[h] for h in hashes]).astype(np.float32)
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def load_chunk_index():
+    """Return the chunk index, loading it from disk on first use."""
+    global _INDEX, _CHUNKS
+    if _INDEX is None and os.path.exists(CHUNK_INDEX_FILE) and os.path.exists(CHUNK_META_FILE):
+        _CHUNKS = _read_json(CHUNK_META_FILE)
+        _INDEX = faiss.read_index(CHUNK_INDEX_FILE)
+    return _INDEX
+
+
+def new_chunk_index(sample_vecs: "np.ndarray"):
+    """
+    Create an empty chunk index for vectors like sample_vecs.
+    With settings.quantize_embeddings, vectors are stored as int8 in a scalar
+    quantizer over [-1, 1], the range of L2-normalized components; otherwise
+    they are stored as float32. The setting only applies when the index is
+    first created.
+    """
+    dim = sample_vecs.shape[1]
+    if not _get_config().get("settings", {}).get("quantize_embeddings", False):
+        return faiss.IndexFlatIP(dim)
+    
+    # Train on the fixed range rather than the first document, whose few
+    # vectors would give later documents a badly fitting range
+    index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit_uniform, faiss.METRIC_INNER_PRODUCT)
+    index.train(np.array([[-1.0] * dim, [1.0] * dim], dtype=np.float32))
+    return index
+
+
+def index_document_chunks(file_path: str, text_content: str) -> int:
+    """
+    Split a document into paragraph chunks, embed them and add them to the chunk index.
+    Returns the number of chunks indexed.
+    """
+    global _INDEX
+    if not FAISS_AVAILABLE:
+        return 0
+    
+    chunks = [chunk.strip() for chunk in PARAGRAPH_RE.split(text_content) if chunk.strip()]
+    if not chunks:
+        return 0
+    
+    vecs = embed_texts(chunks)
+    
+    # Documents are stored as DOCUMENT_STORAGE_DIR/<document_id>/<filename>
+    document_id = os.path.basename(os.path.dirname(file_path))
+    filename = os.path.basename(file_path)
+    
+    with _INDEX_LOCK:
+        if load_chunk_index() is None:
+            _INDEX = new_chunk_index(vecs)
+        _INDEX.add(vecs)
+        _CHUNKS.extend({"document_id": document_id, "filename": filename, "content": chunk} for chunk in chunks)
+        
+        # Persist so a restart does not need to re-embed the library
+        faiss.write_index(_INDEX, CHUNK_INDEX_FILE)
+        _write_json(CHUNK_META_FILE, _CHUNKS)
+    
+    # Cached results do not include the new chunks
+    if _QUERY_CACHE is not None:
+        _QUERY_CACHE.clear()
+    
+    logger.info(f"Indexed {len(chunks)} chunks from {filename}")
+    return len(chunks)
+
+
+def index_for_retrieval(file_path: str, text_content: str) -> None:
+    """Index extracted document text for retrieval without failing ingest."""
+    try:
+        index_document_chunks(file_path, text_content)
+    except Exception as e:
+        logger.warning(f"Could not index chunks for {file_path}: {e}")
+    
+    # Pre-split and tokenize paragraphs for the keyword fallback
+    try:
+        with open(f"{file_path}.paragraphs.pkl", 'wb') as f:
+            pickle.dump(build_paragraph_meta(text_content), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        logger.warning(f"Could not pre-split paragraphs for {file_path}: {e}")
+
+
+# Shared pool for scoring documents in the keyword fallback
+_EXECUTOR = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+
+# LRU cache of extracted document text and its lowercase copy, keyed by path
+# and valid while the mtime is unchanged
+DOC_CACHE_CAPACITY = 64
+_DOC_CACHE: "OrderedDict[str, Tuple[float, str, str]]" = OrderedDict()
+_DOC_CACHE_LOCK = threading.Lock()
+
+
+def load_document_text(path: str) -> Tuple[str, str]:
+    """Return (text, lowercase text) for a document text file, reading it only after it changes."""
+    st = os.stat(path)
+    with _DOC_CACHE_LOCK:
+        entry = _DOC_CACHE.get(path)
+        if entry and entry[0] == st.st_mtime:
+            _DOC_CACHE.move_to_end(path)
+            return entry[1], entry[2]
+    
+    with open(path, 'r') as f:
+        text = f.read()
+    text_lower = text.lower()
+    with _DOC_CACHE_LOCK:
+        _DOC_CACHE[path] = (st.st_mtime, text, text_lower)
+        _DOC_CACHE.move_to_end(path)
+        while len(_DOC_CACHE) > DOC_CACHE_CAPACITY:
+            _DOC_CACHE.popitem(last=False)
+    return text, text_lower
+
+
+# LRU cache of paragraph metadata per document, keyed by file path and valid
+# while its source is unchanged
+PARAGRAPH_CACHE_CAPACITY = 64
+_PARAGRAPH_CACHE: "OrderedDict[str, Tuple[Tuple[str, float], Dict[str, Any]]]" = OrderedDict()
+_PARAGRAPH_CACHE_LOCK = threading.Lock()
+
+
+def build_paragraph_meta(text_content: str) -> Dict[str, Any]:
+    """
+    Split document text into paragraphs and tokenize them for BM25.
+    Returns the paragraphs, their lengths and their term arrays as parallel structures.
+    """
+    paragraphs = PARAGRAPH_RE.split(text_content)
+    term_ids, offsets, vocab = build_term_arrays(paragraphs)
+    return {
+        "paragraphs": paragraphs,
+        "para_len": np.fromiter(map(len, paragraphs), dtype=np.int64, count=len(paragraphs)),
+        "term_ids": term_ids,
+        "offsets": offsets,
+        "vocab": vocab
+    }
+
+
+def load_paragraph_meta(file_path: str) -> Dict[str, Any]:
+    """
+    Return the paragraph metadata of a document.
+    Uses the pickle written at ingest, or splits the text file for older documents.
+    """
+    meta_path = f"{file_path}.paragraphs.pkl"
+    source = meta_path if os.path.exists(meta_path) else f"{file_path}.txt"
+    key = (source, os.stat(source).st_mtime)
+    with _PARAGRAPH_CACHE_LOCK:
+        entry = _PARAGRAPH_CACHE.get(file_path)
+        if entry and entry[0] == key:
+            _PARAGRAPH_CACHE.move_to_end(file_path)
+            return entry[1]
+    
+    if source == meta_path:
+        with open(meta_path, 'rb') as f:
+            meta = pickle.load(f)
+    else:
+        meta = build_paragraph_meta(load_document_text(source)[0])
+    with _PARAGRAPH_CACHE_LOCK:
+        _PARAGRAPH_CACHE[file_path] = (key, meta)
+        _PARAGRAPH_CACHE.move_to_end(file_path)
+        while len(_PARAGRAPH_CACHE) > PARAGRAPH_CACHE_CAPACITY:
+            _PARAGRAPH_CACHE.popitem(last=False)
+    return meta
+
+
+def find_term_positions(text: str, terms: List[str]) -> Dict[str, List[int]]:
+    """
+    Find the start positions of non-overlapping occurrences of each term in text.
+    With pyahocorasick all terms are found in a single pass.
+    """
+    positions = {term: [] for term in terms}
+    if not terms:
+        return positions
+    
+    if AHOCORASICK_AVAILABLE:
+        automaton = ahocorasick.Automaton()
+        for term in positions:
+            automaton.add_word(term, term)
+        automaton.make_automaton()
+        next_free = dict.fromkeys(positions, 0)
+        for end_idx, term in automaton.iter(text):
+            start = end_idx - len(term) + 1
+            if start >= next_free[term]:
+                positions[term].append(start)
+                next_free[term] = end_idx + 1
+        return positions
+    
+    for term in positions:
+        start = text.find(term)
+        while start != -1:
+            positions[term].append(start)
+            start = text.find(term, start + len(term))
+    return positions
+
+
+def search_chunk_index(query: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Return the chunks most similar to the query.
+    Returns None if the chunk index is unavailable or empty.
+    """
+    global _QUERY_CACHE
+    if not FAISS_AVAILABLE:
+        return None
+    
+    with _INDEX_LOCK:
+        index = load_chunk_index()
+    if index is None or index.ntotal == 0:
+        return None
+    
+    q = embed_texts([query])
+    
+    # Chunks of deleted documents stay in the index and the query cache, so
+    # skip them in cached results and over-fetch from the index
+    document_ids = {doc.get("id") for doc in get_document_index().get("documents", [])}
+    
+    if _QUERY_CACHE is None:
+        _QUERY_CACHE = ProximityCache(q.shape[1])
+    cached = _QUERY_CACHE.get(q, limit)
+    if cached is not None and all(chunk["document_id"] in document_ids for chunk in cached):
+        return cached
+    
+    # Search and look up the chunks under the lock, so a concurrent add cannot
+    # leave the index and _CHUNKS out of step
+    with _INDEX_LOCK:
+        D, I = index.search(q, min(index.ntotal, limit * 4))
+        hits = [(float(score), _CHUNKS[i]) for score, i in zip(D[0], I[0])
+                if i >= 0 and score >= MIN_CHUNK_RELEVANCE]
+    
+    results = []
+    for score, chunk in hits:
+        if chunk["document_id"] not in document_ids:
+            continue
+        results.append({**chunk, "relevance": score})
+        if len(results) >= limit:
+            break
+    
+    _QUERY_CACHE.put(q, results, limit)
+    return results
+
+
+def process_document_for_rag(file_path: str) -> Tuple[bool, str, Dict[str, Any]]:
+    """
+    Process a document for RAG by extracting text and generating embeddings.
+    Returns (success, text_content, metadata)
+    """
+    # Get config to check for preferred approaches
+    config = current_app.config.get('CLARIFIER_CONFIG', {})
+    use_model_for_rag = config.get('settings', {}).get('use_model_for_rag', False)
+    
+    # Multimodal integration is optional; document processing is unavailable without it
+    try:
+        _load_multimodal()
+    except ImportError:
+        logger.error("Multimodal integration not available for document processing")
+        return False, "", {"error": "Multimodal integration not available"}
+    
+    try:
+        # Check file extension to determine processing approach
+        file_ext = os.path.splitext(file_path)[1].lower()
+        
+        # For image-based documents (scanned PDFs, images) try using multimodal capabilities
+        is_image_document = file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif']
+        is_pdf = file_ext == '.pdf'
+        
+        # Determine if we should use the model for document processing
+        if use_model_for_rag and (is_image_document or is_pdf):
+            logger.info(f"Using primary LLM for document processing: {file_path}")
+            try:
+                # Use model to extract text with richer context
+                result = process_file(file_path, use_multimodal=True)
+                
+                if result.get('success', False):
+                    # If successful, return the results
+                    extracted_text = result.get('text', '')
+                    
+                    # If content came from a multimodal model, it might be in the 'content' field
+                    if not extracted_text and 'content' in result:
+                        extracted_text = result.get('content', '')
+                    
+                    index_for_retrieval(file_path, extracted_text)
+                    return True, extracted_text, {
+                        "method": result.get('method', 'multimodal'),
+                        "model": result.get('model', config.get('integrations', {}).get('ollama', {}).get('multimodal_model', 'unknown')),
+                        "processing_time": result.get('processing_time', 0)
+                    }
+            except Exception as multimodal_error:
+                logger.warning(f"Multimodal processing failed, falling back to OCR: {multimodal_error}")
+                # Fall back to OCR approach
+        
+        # Use regular text extraction methods
+        logger.info(f"Using standard OCR for document processing: {file_path}")
+        result = process_file(file_path, use_multimodal=False)
+        
+        if not result.get('success', False):
+            return False, "", {"error": result.get('error', 'Unknown error')}
+        
+        # Get the extracted text
+        text_content = result.get('text', '')
+        
+        if not text_content.strip():
+            return False, "", {"error": "No text could be extracted from the document"}
+        
+        index_for_retrieval(file_path, text_content)
+        return True, text_content, {
+            "method": result.get('method', 'ocr'),
+            "processing_time": result.get('processing_time', 0)
+        }
+    except Exception as e:
+        logger.error(f"Error processing document for RAG: {e}")
+        return False, "", {"error": str(e)}
+
+
+def retrieve_relevant_context(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """
+    Retrieve relevant document sections based on a query.
+    Returns a list of relevant document chunks.
+    """
+    try:
+        # Get config to check for preferred approaches
+        config = current_app.config.get('CLARIFIER_CONFIG', {})
+        use_full_doc = config.get('settings', {}).get('rag_full_documents', False)
+        
+        # Get all documents
+        index_data = get_document_index()
+        documents = index_data.get("documents", [])
+        
+        # If no documents, return empty results
+        if not documents:
+            logger.warning("No documents found in the index.")
+            return []
+        
+        # Use the semantic chunk index when available
+        if not use_full_doc:
+            try:
+                semantic_results = search_chunk_index(query, limit)
+                if semantic_results is not None:
+                    logger.info(f"Found {len(semantic_results)} relevant chunks in the chunk index")
+                    return semantic_results
+            except Exception as index_error:
+                logger.warning(f"Chunk index search failed, falling back to keyword matching: {index_error}")
+        
+        # Fall back to keyword matching and relevance scoring
+        # Extract important terms from query, excluding stopwords
+        stopwords = {'a', 'an', 'the', 'and', 'or', 'but', 'is', 'are', 'was', 'were', 
+                    'of', 'for', 'in', 'to', 'with', 'on', 'at', 'from', 'by', 'about'}
+        query_terms = [term.lower() for term in query.split() if term.lower() not in stopwords]
+        # Skip very short terms
+        scored_terms = [term for term in dict.fromkeys(query_terms) if len(term) >= 3]
+        query_tokens = [token for token in tokenize(query) if token not in stopwords]
+        
+        def _score_doc(doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            """Score one document and return its result entry, or None if it does not match."""
+            doc_path = doc.get("file_path")
+            if not doc_path or not os.path.exists(doc_path):
+                return None
+                
+            try:
+                # Read text content from file
+                text_file_path = f"{doc_path}.txt"
+                if not os.path.exists(text_file_path):
+                    logger.warning(f"Text file not found: {text_file_path}")
+                    return None
+                    
+                content, content_lower = load_document_text(text_file_path)
+                
+                # Skip empty content
+                if not content.strip():
+                    return None
+                
+                # Calculate relevance score based on term frequency and position
+                score = 0
+                
+                # Count term occurrences and weight by position (terms near beginning count more)
+                term_positions = find_term_positions(content_lower, scored_terms)
+                for term in query_terms:
+                    positions = term_positions.get(term)
+                    
+                    if positions:
+                        # Calculate position-weighted score (earlier occurrences worth more)
+                        position_scores = [1.0 - (pos / len(content_lower)) * 0.5 for pos in positions]
+                        term_score = sum(position_scores) * len(term) / 5  # Longer term matches worth more
+                        score += term_score
+                
+                # If any terms matched or we're using full doc mode, add to results
+                if score > 0 or use_full_doc:
+                    # Decide how much content to include
+                    if use_full_doc:
+                        # In advanced mode, include the full document
+                        chunk_content = content
+                    else:
+                        # In regular mode, find the most relevant chunk
+                        # Use the paragraphs split and tokenized at ingest
+                        meta = load_paragraph_meta(doc_path)
+                        paragraphs = meta["paragraphs"]
+                        para_len = meta["para_len"]
+                        
+                        # Score each paragraph with BM25
+                        para_scores = bm25_scores(meta["term_ids"], meta["offsets"], meta["vocab"], query_tokens)
+                        
+                        # Select the top paragraphs; only a few fit in the chunk anyway
+                        k = min(16, len(paragraphs))
+                        top = np.argpartition(para_scores, -k)[-k:]
+                        top = top[np.argsort(-para_scores[top], kind='stable')]
+                        
+                        # Combine top paragraphs up to a reasonable size
+                        combined_content = ""
+                        total_length = 0
+                        max_chunk_size = 2000  # Set a reasonable size
+                        
+                        for i in top:
+                            if total_length + para_len[i] <= max_chunk_size:
+                                combined_content += paragraphs[i] + "\n\n"
+                                total_length += para_len[i] + 2
+                            else:
+                                break
+                        
+                        chunk_content = combined_content.strip()
+                    
+                    return {
+                        "document_id": doc.get("id"),
+                        "filename": doc.get("filename"),
+                        "content": chunk_content,
+                        "relevance": score
+                    }
+            except Exception as inner_e:
+                logger.error(f"Error processing document {doc.get('filename')}: {inner_e}")
+            return None
+        
+        # Score documents in parallel so their file reads overlap
+        results = [result for result in _EXECUTOR.map(_score_doc, documents) if result]
+        
+        # Sort by relevance and limit results
+        results.sort(key=lambda x: x["relevance"], reverse=True)
+        
+        # In advanced mode, we might want to return fewer documents but with more content
+        if use_full_doc and limit > 3:
+            limit = min(3, len(results))  # Return at most 3 full documents
+            
+        logger.info(f"Found {len(results)} relevant documents, returning top {limit}")
+        
+        return results[:limit]
+    except Exception as e:
+        logger.error(f"Error retrieving relevant context: {e}")
+        return []
+
+
+# Multimodal document processing
+DEFAULT_IMAGE_PROMPT = "Please analyze this image and extract the text content. Then, provide any insights about the content and its context."
+
+# Concurrent multimodal requests sent to Ollama for one PDF
+MAX_CONCURRENT_PAGES = 4
+_PAGE_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PAGES)
+
+# Multimodal replies are streamed into a per-thread buffer in chunks of this size
+RESPONSE_CHUNK_SIZE = 65536
+_RESPONSE_BUFFERS = threading.local()
+
+# Image files are base64-encoded in blocks of this size (a multiple of 3, so
+# no padding appears between blocks)
+B64_BLOCK_SIZE = 65535
+
+
+@functools.lru_cache(maxsize=128)
+def _pypdf2_extract_cached(pdf_path: str, mtime: float) -> str:
+    import PyPDF2
+    
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return "".join((page.extract_text() or "") + "\n\n" for page in pdf_reader.pages)
+
+
+def _pypdf2_extract(pdf_path: str) -> str:
+    """Extract the embedded text of a PDF with PyPDF2, cached by path and mtime."""
+    return _pypdf2_extract_cached(pdf_path, os.path.getmtime(pdf_path))
+
+
+def _b64encode_file(path: str) -> bytearray:
+    """Base64-encode a file block by block without reading it into memory whole."""
+    encoded = bytearray()
+    with open(path, "rb") as f:
+        for block in iter(functools.partial(f.read, B64_BLOCK_SIZE), b""):
+            encoded += base64.b64encode(block)
+    return encoded
+
+
+@functools.lru_cache(maxsize=32)
+def _chat_body_prefix(model: str, prompt: str) -> bytes:
+    """The JSON of an Ollama /api/chat request up to the image data."""
+    return ('{"model":%s,"messages":[{"role":"user","content":%s,"images":["'
+            % (json.dumps(model), json.dumps(prompt))).encode("ascii")
+
+
+def _chat_request_body(model: str, prompt: str, base64_image: bytes) -> bytes:
+    """Build an Ollama /api/chat request body around an already encoded image."""
+    return b"".join((_chat_body_prefix(model, prompt), base64_image, b'"]}]}'))
+
+
+def _read_body(response) -> bytearray:
+    """Read a streamed response into this thread's reusable buffer."""
+    buf = getattr(_RESPONSE_BUFFERS, "buf", None)
+    if buf is None:
+        buf = _RESPONSE_BUFFERS.buf = bytearray()
+    del buf[:]
+    for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+        buf += chunk
+    return buf
+
+
+def _chat_content(body: bytes) -> str:
+    """
+    Extract the reply text from an Ollama /api/chat response body.
+    A streamed reply has one JSON object per line; their contents are joined.
+    Raises ValueError if the body is not JSON.
+    """
+    try:
+        return _loads(body).get("message", {}).get("content", "")
+    except ValueError:
+        return "".join(_loads(line).get("message", {}).get("content", "")
+                       for line in body.splitlines() if line.strip())
+
+
+def _analyze_pdf_pages(page_images: List[bytes], prompts: List[Optional[str]], model: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Analyze PDF page images with the multimodal model, up to MAX_CONCURRENT_PAGES at a time.
+    Returns one analyze_image_with_multimodal result per page.
+    """
+    def _analyze_page(img_bytes: bytes, prompt: Optional[str]) -> Dict[str, Any]:
+        return analyze_image_with_multimodal(prompt=prompt, model=model, image_bytes=img_bytes)
+    
+    return list(_PAGE_EXECUTOR.map(_analyze_page, page_images, prompts))
+
+
+def analyze_image_with_multimodal(image_path: Optional[str] = None, prompt: Optional[str] = None, model: Optional[str] = None,
+                                  image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+    """
+    Analyze an image using a multimodal model through Ollama.
+    
+    Args:
+        image_path: Path to the image file
+        prompt: Optional prompt to guide the analysis
+        model: Optional model override
+        image_bytes: Encoded image data to analyze instead of reading image_path
+        
+    Returns:
+        Analysis result
+    """
+    # Get configuration
+    config = _load_multimodal().load_config()
+    
+    # Check if multimodal models are defined
+    if not model:
+        model = config.get("integrations", {}).get("ollama", {}).get("multimodal_model", "llava:latest")
+    
+    # Prepare the prompt
+    if not prompt:
+        prompt = DEFAULT_IMAGE_PROMPT
+    
+    try:
+        # Encode the image as base64, streaming it from disk if no bytes were given
+        if image_bytes is None:
+            base64_image = _b64encode_file(image_path)
+        else:
+            base64_image = base64.b64encode(image_bytes)
+        
+        # Call Ollama API for multimodal analysis; the image is spliced into
+        # the request body rather than re-encoded by json.dumps
+        response = _OLLAMA_SESSION.post(
+            "http://localhost:11434/api/chat",
+            data=_chat_request_body(model, prompt, base64_image),
+            headers={"Content-Type": "application/json"},
+            stream=True
+        )
+        if not response.ok:
+            error_msg = f"Error calling multimodal model: {response.status_code} - {response.text}"
+            logger.error(error_msg)
+            return {
+                "success": False,
+                "error": error_msg
+            }
+        body = _read_body(response)
+    except (OSError, requests.RequestException) as e:
+        error_msg = f"Error analyzing image with multimodal model: {str(e)}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg
+        }
+    
+    try:
+        content = _chat_content(body)
+    except ValueError:
+        # If we can't parse it, just return the raw text
+        content = f"Raw response: {body[:500].decode('utf-8', 'replace')}..."
+    except (AttributeError, TypeError) as e:
+        # The reply is JSON but not a chat message object
+        error_msg = f"Error analyzing image with multimodal model: {str(e)}"
+        logger.error(error_msg)
+        return {
+            "success": False,
+            "error": error_msg
+        }
+    return {
+        "success": True,
+        "content": content,
+        "model": model
+    }
+
+
+def process_file(file_path: str, use_multimodal: bool = True) -> Dict[str, Any]:
+    """
+    Process a file (image or PDF) and extract text or analyze with multimodal model.
+    
+    Args:
+        file_path: Path to the file
+        use_multimodal: Whether to use multimodal analysis
+        
+    Returns:
+        Processing result
+    """
+    mm = _load_multimodal()
+    
+    # Ensure dependencies are installed
+    if not mm.check_dependencies():
+        return {
+            "success": False,
+            "error": "Required dependencies are not available"
+        }
+    
+    # Determine file type
+    file_ext = os.path.splitext(file_path)[1].lower()
+    
+    # Get configuration to determine which model to use
+    config = mm.load_config()
+    use_primary_model = config.get("settings", {}).get("use_model_for_rag", False)
+    
+    # If we're using the primary model, we'll need to check what it is
+    primary_model = None
+    multimodal_model = None
+    
+    if use_primary_model:
+        primary_model = config.get("integrations", {}).get("ollama", {}).get("default_model", "gemma3:latest")
+        multimodal_model = config.get("integrations", {}).get("ollama", {}).get("multimodal_model", "llava:latest")
+        
+        # Check if primary model supports multimodal
+        primary_is_multimodal = any(mm in primary_model.lower() for mm in ["gemma", "llama3", "phi3", "qwen2"])
+        
+        if primary_is_multimodal:
+            multimodal_model = primary_model  # Use primary model for multimodal if it supports it
+    
+    # For image files
+    if file_ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.gif']:
+        if use_multimodal:
+            # Use multimodal analysis
+            start_time = time.time()
+            
+            # Use primary model if configured to do so and it's multimodal
+            if use_primary_model and multimodal_model == primary_model:
+                prompt = "Please analyze this image and extract all visible text content. Then, provide a detailed description of what you see in the image."
+                result = analyze_image_with_multimodal(file_path, prompt, model=primary_model)
+            else:
+                # Use default multimodal model
+                result = analyze_image_with_multimodal(file_path)
+            
+            # Add timing information
+            if result.get("success", False):
+                result["processing_time"] = time.time() - start_time
+                result["method"] = "multimodal"
+                result["model"] = multimodal_model
+            
+            return result
+        else:
+            # Use OCR
+            try:
+                start_time = time.time()
+                text = mm.perform_ocr(file_path)
+                return {
+                    "success": True,
+                    "text": text,
+                    "method": "ocr",
+                    "processing_time": time.time() - start_time
+                }
+            except Exception as e:
+                return {
+                    "success": False,
+                    "error": f"Error performing OCR: {str(e)}"
+                }
+    
+    # For PDF files
+    elif file_ext == '.pdf':
+        try:
+            start_time = time.time()
+            
+            # First, try to extract text directly without OCR; text PDFs stop here
+            try:
+                text = _pypdf2_extract(file_path)
+                if len(text.strip()) > 100:
+                    return {
+                        "success": True,
+                        "text": text,
+                        "method": "pdf_text_extraction",
+                        "processing_time": time.time() - start_time
+                    }
+            except Exception as pdf_error:
+                print(f"PDF text extraction failed, falling back to OCR: {pdf_error}")
+            
+            # Only scanned PDFs get here: try OCR, then the multimodal model if OCR fails
+            text = mm.extract_text_from_pdf(file_path)
+            
+            # If OCR returned too little text or has encoding issues, try multimodal
+            if use_multimodal and (len(text.strip()) < 100 or "�" in text):
+                # Try with multimodal model if enabled
+                images = mm.pdf2image.convert_from_path(file_path, first_page=1, last_page=3)  # Process first 3 pages
+                all_content = ""
+                
+                # Encode the pages in memory rather than through temporary files
+                page_images = []
+                for img in images:
+                    buf = io.BytesIO()
+                    img.save(buf, format='PNG')
+                    page_images.append(buf.getvalue())
+                
+                # Process all pages with the appropriate model
+                if use_primary_model and multimodal_model == primary_model:
+                    prompts = [f"This is page {i+1} of a PDF document. Please extract all visible text content from this image, preserving any formatting, tables, and structure as much as possible." for i in range(len(page_images))]
+                    page_results = _analyze_pdf_pages(page_images, prompts, model=primary_model)
+                else:
+                    page_results = _analyze_pdf_pages(page_images, [None] * len(page_images))
+                
+                for i, result in enumerate(page_results):
+                    # If successful, add to content
+                    if result.get("success", False):
+                        if "content" in result:
+                            all_content += f"--- Page {i+1} ---\n{result['content']}\n\n"
+                        elif "text" in result:
+                            all_content += f"--- Page {i+1} ---\n{result['text']}\n\n"
+                
+                if all_content.strip():
+                    return {
+                        "success": True,
+                        "text": all_content,
+                        "method": "multimodal_pdf",
+                        "model": multimodal_model,
+                        "processing_time": time.time() - start_time
+                    }
+            
+            # Return OCR result if it's valid
+            if text.strip():
+                return {
+                    "success": True,
+                    "text": text,
+                    "method": "ocr_pdf",
+                    "processing_time": time.time() - start_time
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": "Failed to extract meaningful text from PDF"
+                }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Error processing PDF: {str(e)}"
+            }
+    
+    # For text-based documents
+    elif file_ext in ['.txt', '.md', '.html', '.csv', '.json', '.xml', '.rst', '.tex']:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            
+            return {
+                "success": True,
+                "text": text,
+                "method": "text_extraction",
+                "processing_time": 0
+            }
+        except UnicodeDecodeError:
+            # Try with different encoding
+            try:
+                with open(file_path, 'r', encoding='latin-1') as f:
+                    text = f.read()
+                
+                return {
+                    "success": True,
+                    "text": text,
+                    "method": "text_extraction",
+                    "processing_time": 0
+                }
+            except Exception as e:
+                return {
+                    "success": False,
+                    "error": f"Error reading text file: {str(e)}"
+                }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Error processing text file: {str(e)}"
+            }
+    
+    # For MS Office documents, we'd need additional libraries like python-docx, etc.
+    # This can be expanded as needed
+    
+    # Unsupported file type
+    else:
+        return {
+            "success": False,
+            "error": f"Unsupported file type: {file_ext}"
+        }
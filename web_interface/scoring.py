@@ -0,0 +1,114 @@
+"""
+BM25 paragraph scoring for keyword-based document retrieval.
+
+Paragraphs are tokenized once at ingest into int32 term-ID arrays, which the
+document routes persist with the document. At query time the scoring loop
+runs over those arrays, compiled with numba when it is installed.
+"""
+
+import re
+from typing import List, Tuple
+
+import numpy as np
+
+# numba is optional; without it the scorer runs as plain Python
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit that returns the function unchanged."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+TOKEN_RE = re.compile(r"\w+")
+PARAGRAPH_RE = re.compile(r"\n\n+")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def build_term_arrays(paragraphs: List[str]) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Tokenize paragraphs against a shared vocabulary.
+    Returns (term_ids, offsets, vocab): the term IDs of all paragraphs
+    concatenated, the start of each paragraph in term_ids (plus the end), and
+    the vocabulary in term-ID order.
+    """
+    vocab = {}
+    term_ids = []
+    offsets = [0]
+    for paragraph in paragraphs:
+        for token in tokenize(paragraph):
+            term_ids.append(vocab.setdefault(token, len(vocab)))
+        offsets.append(len(term_ids))
+    return (np.asarray(term_ids, dtype=np.int32),
+            np.asarray(offsets, dtype=np.int64),
+            list(vocab))
+
+
+@njit(cache=True)
+def bm25_score(doc_term_ids, doc_len, avgdl, q_ids, idf, k1=BM25_K1, b=BM25_B):
+    """BM25 score of one paragraph for the query term IDs."""
+    norm = k1 * (1.0 - b + b * doc_len / avgdl)
+    score = 0.0
+    for q in q_ids:
+        tf = 0
+        for t in doc_term_ids:
+            if t == q:
+                tf += 1
+        if tf > 0:
+            score += idf[q] * tf * (k1 + 1.0) / (tf + norm)
+    return score
+
+
+# Not parallel: documents are already scored from a thread pool, and numba's
+# default threading layer must not be entered from several threads at once
+@njit(cache=True)
+def _bm25_scores(term_ids, offsets, q_ids, idf, avgdl, k1, b):
+    n = offsets.shape[0] - 1
+    out = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        start = offsets[i]
+        end = offsets[i + 1]
+        out[i] = bm25_score(term_ids[start:end], end - start, avgdl, q_ids, idf, k1, b)
+    return out
+
+
+def bm25_scores(term_ids: np.ndarray, offsets: np.ndarray, vocab: List[str],
+                query_terms: List[str]) -> np.ndarray:
+    """
+    Score every paragraph of a document against the query terms.
+    IDF is computed over the document's own paragraphs.
+    """
+    n = len(offsets) - 1
+    if n == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    term_index = {term: i for i, term in enumerate(vocab)}
+    q_ids = np.asarray(sorted({term_index[t] for t in query_terms if t in term_index}), dtype=np.int32)
+    if len(q_ids) == 0:
+        return np.zeros(n, dtype=np.float64)
+
+    # Number of paragraphs containing each term
+    paragraph_of = np.repeat(np.arange(n), np.diff(offsets))
+    doc_freqs = np.zeros(len(vocab), dtype=np.float64)
+    np.add.at(doc_freqs, np.unique(np.stack([paragraph_of, term_ids]), axis=1)[1], 1.0)
+    idf = np.log(1.0 + (n - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+    avgdl = max(len(term_ids) / n, 1.0)
+    return _bm25_scores(term_ids, offsets, q_ids, idf, avgdl, BM25_K1, BM25_B)
+
+
+# Compile at import so the first query does not pay the JIT cost
+if NUMBA_AVAILABLE:
+    _bm25_scores(np.zeros(1, dtype=np.int32), np.array([0, 1], dtype=np.int64),
+                 np.zeros(1, dtype=np.int32), np.ones(1, dtype=np.float64), 1.0, BM25_K1, BM25_B)